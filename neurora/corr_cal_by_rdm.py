@@ -5,19 +5,73 @@
 __author__ = 'Zitong Lu'
 
 import numpy as np
-import math
-from neurora.rdm_corr import rdm_correlation_spearman
-from neurora.rdm_corr import rdm_correlation_pearson
-from neurora.rdm_corr import rdm_correlation_kendall
-from neurora.rdm_corr import rdm_similarity
-from neurora.rdm_corr import rdm_distance
+from concurrent.futures import ThreadPoolExecutor
+from neurora.stuff import rank_vectors
+from neurora.rdm_stack import CondensedRDMStack, RDMBatches
+from neurora.rdm_store import RDMStore
+from neurora.rdm_corr import rdm_correlation_batch
+from neurora.rdm_corr import rdm_vectors
+from neurora.rdm_corr import vectors_correlation
 
 np.seterr(divide='ignore', invalid='ignore')
 
 
+' a function for flattening the leading axes of RDMs '
+
+def _flatten_rdms(rdms):
+
+    # a store on disk: the flattened RDMs are still memory-mapped
+    if isinstance(rdms, RDMStore):
+        return rdms.flat(), rdms.shape
+
+    # a condensed stack: [...] -> [n]
+    if isinstance(rdms, CondensedRDMStack):
+        return rdms.reshape([-1]), rdms.shape
+
+    # full RDMs: [..., n_cons, n_cons] -> [n, n_cons, n_cons]
+    rdms = np.asarray(rdms)
+    cons = rdms.shape[-1]
+
+    return np.reshape(rdms, [-1, cons, cons]), rdms.shape[:-2]
+
+
+' a function for calculating the Similarity/Correlation Cosfficient between RDMs and a demo RDM block by block '
+
+def _rdms_corr_blocks(demo_rdm, rdms, method, rescale, mem_budget):
+
+    # the lazy batches are calculated & compared one by one
+    if isinstance(rdms, RDMBatches):
+        corrs = np.zeros(rdms.shape + (2,), dtype=np.float64)
+        for index, batch in rdms:
+            corrs[index] = rdm_correlation_batch(demo_rdm, batch, method=method, rescale=rescale)
+        return corrs
+
+    # flatten the leading axes: [..., n_cons, n_cons] -> [n, n_cons, n_cons]
+    rdms, shape = _flatten_rdms(rdms)
+    n = len(rdms)
+
+    # get the number of conditions & the number of values above the diagonal
+    cons = np.shape(demo_rdm)[-1]
+    n_values = int(cons*(cons-1)/2)
+
+    # the number of RDMs in each block
+    # each RDM costs its full matrix & a few copies of its vector
+    block = max(1, int(mem_budget / (8 * (cons*cons + 3*n_values))))
+
+    # initialize the corrs
+    corrs = np.zeros([n, 2], dtype=np.float64)
+
+    # calculate the corrs block by block, so RDMs on disk are only read block by block
+    for i in range(0, n, block):
+        corrs[i:i+block] = rdm_correlation_batch(demo_rdm, rdms[i:i+block], method=method, rescale=rescale)
+
+    # [n, 2] -> [..., 2]
+    return np.reshape(corrs, shape + (2,))
+
+
 ' a function for calculating the Similarity/Correlation Cosfficient between RDMs based on EEG/MEG/fNIRS/ECoG/sEEG/electrophysiological RDMs and a demo RDM'
 
-def rdms_corr(demo_rdm, eeg_rdms, method="spearman", rescale=False):
+def rdms_corr(demo_rdm, eeg_rdms, method="spearman", rescale=False, mem_budget=2**28):
 
     """
     Calculate the Similarities between EEG/MEG/fNIRS/ECoG/sEEG/electrophysiological RDMs and a demo RDM
@@ -26,10 +80,11 @@ def rdms_corr(demo_rdm, eeg_rdms, method="spearman", rescale=False):
     ----------
     demo_rdm : array [n_cons, n_cons]
         A demo RDM.
-    eeg_rdms : array
+    eeg_rdms : array or CondensedRDMStack or RDMStore or RDMBatches
         The EEG/MEG/fNIRS/ECoG/sEEG/electrophysiological RDM(s).
         The shape can be [n_cons, n_cons] or [n1, n_cons, n_cons] or [n1, n2, n_cons, n_cons] or
-        [n1, n2, n3, n_cons, n_cons]. ni(i=1, 2, 3) can be int(n_ts/timw_win), n_chls, n_subs.
+        [n1, n2, n3, n_cons, n_cons] or any [..., n_cons, n_cons]. ni(i=1, 2, 3, ...) can be int(n_ts/timw_win),
+        n_chls, n_subs, n_freqs.
     method : string 'spearman' or 'pearson' or 'kendall' or 'similarity' or 'distance'. Default is 'spearman'.
         The method to calculate the similarities.
         If method='spearman', calculate the Spearman Correlations. If method='pearson', calculate the Pearson
@@ -38,6 +93,9 @@ def rdms_corr(demo_rdm, eeg_rdms, method="spearman", rescale=False):
     rescale : bool True or False.
         Rescale the values in RDM or not.
         Here, the maximum-minimum method is used to rescale the values except for the values on the diagonal.
+    mem_budget : int. Default is 2**28 (256 MB).
+        The approximate memory budget in bytes for each block of RDMs.
+        The RDMs are processed block by block to fit this budget, so an RDMStore is never fully loaded.
 
     Returns
     -------
@@ -46,155 +104,313 @@ def rdms_corr(demo_rdm, eeg_rdms, method="spearman", rescale=False):
         If the shape of eeg_rdms is [n_cons, n_cons], the shape of corrs will be [2]. If the shape of eeg_rdms is
         [n1, n_cons, n_cons], the shape of corrs will be [n1, 2]. If the shape of eeg_rdms is [n1, n2, n_cons, n_cons],
         the shape of corrs will be [n1, n2, 2]. If the shape of eeg_rdms is [n1, n2, n3, n_cons, n_cons], the shape of
-        corrs will be [n1, n2, n3, 2]. ni(i=1, 2, 3) can be int(n_ts/timw_win), n_chls, n_subs. 2 represents a r-value
-        and a p-value.
+        corrs will be [n1, n2, n3, 2]. In general, the shape of corrs is [..., 2]. ni(i=1, 2, 3, ...) can be
+        int(n_ts/timw_win), n_chls, n_subs, n_freqs. 2 represents a r-value and a p-value.
     """
 
-    if len(eeg_rdms.shape) == 5:
+    # calculate the corrs block by block: [..., 2]
+    return _rdms_corr_blocks(demo_rdm, eeg_rdms, method, rescale, mem_budget)
+
 
-        n1, n2, n3 = eeg_rdms.shape[:3]
+' a function for calculating the Similarity/Correlation Cosfficient between fMRI RDMs and a demo RDM'
 
-        # initialize the corrs
-        corrs = np.zeros([n1, n2, n3, 2], dtype=np.float64)
+def fmrirdms_corr(demo_rdm, fmri_rdms, method="spearman", rescale=False, mem_budget=2**28):
 
-        # calculate the corrs
-        for i in range(n1):
-            for j in range(n2):
-                for k in range(n3):
 
-                    if method == "spearman":
-                        corrs[i, j] = rdm_correlation_spearman(demo_rdm, eeg_rdms[i, j], rescale=rescale)
-                    elif method == "pearson":
-                        corrs[i, j] = rdm_correlation_pearson(demo_rdm, eeg_rdms[i, j], rescale=rescale)
-                    elif method == "kendall":
-                        corrs[i, j] = rdm_correlation_kendall(demo_rdm, eeg_rdms[i, j], rescale=rescale)
-                    elif method == "similarity":
-                        corrs[i, j, 0] = rdm_similarity(demo_rdm, eeg_rdms[i, j], rescale=rescale)
-                    elif method == "distance":
-                        corrs[i, j, 0] = rdm_distance(demo_rdm, eeg_rdms[i, j], rescale=rescale)
+    """
+    Calculate the Similarities between fMRI searchlight RDMs and a demo RDM
 
-        return corrs
+    Parameters
+    ----------
+    demo_rdm : array [n_cons, n_cons]
+        A demo RDM.
+    fmri_rdms : array or CondensedRDMStack or RDMStore or RDMBatches
+        The fMRI-Searchlight RDMs.
+        The shape of RDMs is [n_x, n_y, n_z, n_cons, n_cons]. n_x, n_y, n_z represent the number of calculation units
+        for searchlight along the x, y, z axis.
+    method : string 'spearman' or 'pearson' or 'kendall' or 'similarity' or 'distance'. Default is 'spearman'.
+        The method to calculate the similarities.
+        If method='spearman', calculate the Spearman Correlations. If method='pearson', calculate the Pearson
+        Correlations. If methd='kendall', calculate the Kendall tau Correlations. If method='similarity', calculate the
+        Cosine Similarities. If method='distance', calculate the Euclidean Distances.
+    rescale : bool True or False.
+        Rescale the values in RDM or not.
+        Here, the maximum-minimum method is used to rescale the values except for the values on the diagonal.
+    mem_budget : int. Default is 2**28 (256 MB).
+        The approximate memory budget in bytes for each block of RDMs.
+        The RDMs are processed block by block to fit this budget, so an RDMStore is never fully loaded.
 
-    if len(eeg_rdms.shape) == 4:
+    Returns
+    -------
+    corrs : array
+        The similarities between fMRI searchlight RDMs and a demo RDM
+        The shape of RDMs is [n_x, n_y, n_z, 2]. n_x, n_y, n_z represent the number of calculation units for searchlight
+        along the x, y, z axis and 2 represents a r-value and a p-value.
+    """
 
-        n1, n2 = eeg_rdms.shape[:2]
+    # calculate the corrs block by block: [n_x, n_y, n_z, 2]
+    corrs = _rdms_corr_blocks(demo_rdm, fmri_rdms, method, rescale, mem_budget)
 
-        # initialize the corrs
-        corrs = np.zeros([n1, n2, 2], dtype=np.float64)
+    return np.abs(corrs)
 
-        # calculate the corrs
-        for i in range(n1):
-            for j in range(n2):
 
-                if method == "spearman":
-                    corrs[i, j] = rdm_correlation_spearman(demo_rdm, eeg_rdms[i, j], rescale=rescale)
-                elif method == "pearson":
-                    corrs[i, j] = rdm_correlation_pearson(demo_rdm, eeg_rdms[i, j], rescale=rescale)
-                elif method == "kendall":
-                    corrs[i, j] = rdm_correlation_kendall(demo_rdm, eeg_rdms[i, j], rescale=rescale)
-                elif method == "similarity":
-                    corrs[i, j, 0] = rdm_similarity(demo_rdm, eeg_rdms[i, j], rescale=rescale)
-                elif method == "distance":
-                    corrs[i, j, 0] = rdm_distance(demo_rdm, eeg_rdms[i, j], rescale=rescale)
+' a function for calculating the Similarity/Correlation Cosfficient between many model RDMs and many RDMs '
 
-        return corrs
+def rdms_corr_matrix(model_rdms, rdms, method="spearman", rescale=False, mem_budget=2**28):
 
-    if len(eeg_rdms.shape) == 3:
+    """
+    Calculate the Similarities between each model RDM and each EEG/MEG/fNIRS/ECoG/sEEG/electrophysiological/fMRI RDM
 
-        n1 = eeg_rdms.shape[0]
+    Parameters
+    ----------
+    model_rdms : array [n_models, n_cons, n_cons] or CondensedRDMStack
+        The model RDMs, such as the RDMs of different DNN layers or semantic models.
+    rdms : array or CondensedRDMStack or RDMStore or RDMBatches
+        The neural RDMs.
+        The shape can be [n, n_cons, n_cons] or any [..., n_cons, n_cons], such as [n_ts, n_cons, n_cons] or
+        [n_x, n_y, n_z, n_cons, n_cons].
+    method : string 'spearman' or 'pearson' or 'kendall' or 'similarity' or 'distance'. Default is 'spearman'.
+        The method to calculate the similarities.
+        If method='spearman', calculate the Spearman Correlations. If method='pearson', calculate the Pearson
+        Correlations. If methd='kendall', calculate the Kendall tau Correlations. If method='similarity', calculate the
+        Cosine Similarities. If method='distance', calculate the Euclidean Distances.
+    rescale : bool True or False.
+        Rescale the values in RDM or not.
+        Here, the maximum-minimum method is used to rescale the values except for the values on the diagonal.
+    mem_budget : int. Default is 2**28 (256 MB).
+        The approximate memory budget in bytes for each block of neural RDMs.
+        The neural RDMs are processed block by block to fit this budget.
+
+    Returns
+    -------
+    corrs : array
+        The similarities between the model RDMs and the neural RDMs.
+        If the shape of rdms is [n, n_cons, n_cons], the shape of corrs is [n_models, n, 2]. In general, the shape of
+        corrs is [n_models, ..., 2]. 2 represents a r-value and a p-value. If method='similarity' or method='distance',
+        the p-values are all 0.
+
+    Notes
+    -----
+    The values above the diagonal of each RDM are ranked & normalized only once, and each block is compared with all
+    model RDMs by one matrix product.
+    """
 
-        # initialize the corrs
-        corrs = np.zeros([n1, 2], dtype=np.float64)
+    # get the vectors of the model RDMs once
+    model_vectors = rdm_vectors(model_rdms, method=method, rescale=rescale)
 
-        # calculate the corrs
-        for i in range(n1):
-            if method == "spearman":
-                corrs[i] = rdm_correlation_spearman(demo_rdm, eeg_rdms[i], rescale=rescale)
-            elif method == "pearson":
-                corrs[i] = rdm_correlation_pearson(demo_rdm, eeg_rdms[i], rescale=rescale)
-            elif method == "kendall":
-                corrs[i] = rdm_correlation_kendall(demo_rdm, eeg_rdms[i], rescale=rescale)
-            elif method == "similarity":
-                corrs[i, 0] = rdm_similarity(demo_rdm, eeg_rdms[i], rescale=rescale)
-            elif method == "distance":
-                corrs[i, 0] = rdm_distance(demo_rdm, eeg_rdms[i], rescale=rescale)
+    # get the number of models & the number of conditions
+    n_models, n_values = model_vectors.shape
+    cons = int(round((1 + np.sqrt(1 + 8*n_values)) / 2))
 
+    # the lazy batches are calculated & compared one by one
+    if isinstance(rdms, RDMBatches):
+        corrs = np.zeros((n_models,) + rdms.shape + (2,), dtype=np.float64)
+        for index, batch in rdms:
+            vectors = rdm_vectors(batch, method=method, rescale=rescale)
+            key = (slice(None),) + index
+            corrs[key] = np.reshape(vectors_correlation(model_vectors, vectors, method=method), corrs[key].shape)
         return corrs
 
+    # flatten the leading axes: [..., n_cons, n_cons] -> [n, n_cons, n_cons]
+    rdms, shape = _flatten_rdms(rdms)
+    n = len(rdms)
+
+    # the number of neural RDMs in each block
+    # each RDM costs its full matrix, a few copies of its vector and a row of results
+    block = max(1, int(mem_budget / (8 * (cons*cons + 3*n_values + 2*n_models))))
+
     # initialize the corrs
-    corr = np.zeros([2], dtype=np.float64)
+    corrs = np.zeros([n_models, n, 2], dtype=np.float64)
 
-    # calculate the corrs
-    if method == "spearman":
-        corr = rdm_correlation_spearman(demo_rdm, eeg_rdms, rescale=rescale)
-    elif method == "pearson":
-        corr = rdm_correlation_pearson(demo_rdm, eeg_rdms, rescale=rescale)
-    elif method == "kendall":
-        corr = rdm_correlation_kendall(demo_rdm, eeg_rdms, rescale=rescale)
-    elif method == "similarity":
-        corr[0] = rdm_similarity(demo_rdm, eeg_rdms, rescale=rescale)
-    elif method == "distance":
-        corr[0] = rdm_distance(demo_rdm, eeg_rdms, rescale=rescale)
+    # calculate the corrs block by block
+    for i in range(0, n, block):
 
-    return corr
+        vectors = rdm_vectors(rdms[i:i+block], method=method, rescale=rescale)
+        corrs[:, i:i+block] = vectors_correlation(model_vectors, vectors, method=method)
 
+    # [n_models, n, 2] -> [n_models, ..., 2]
+    return np.reshape(corrs, (n_models,) + shape + (2,))
 
-' a function for calculating the Similarity/Correlation Cosfficient between fMRI RDMs and a demo RDM'
 
-def fmrirdms_corr(demo_rdm, fmri_rdms, method="spearman", rescale=False):
+' a function for calculating the noise ceiling of RDMs across subjects '
 
+def rdms_noise_ceiling(rdms, method="spearman", rescale=False):
 
     """
-    Calculate the Similarities between fMRI searchlight RDMs and a demo RDM
+    Calculate the lower & upper bounds of the noise ceiling for RDMs of multiple subjects
 
     Parameters
     ----------
-    demo_rdm : array [n_cons, n_cons]
-        A demo RDM.
-    fmri_rdms : array
-        The fMRI-Searchlight RDMs.
-        The shape of RDMs is [n_x, n_y, n_z, n_cons, n_cons]. n_x, n_y, n_z represent the number of calculation units
-        for searchlight along the x, y, z axis.
-    method : string 'spearman' or 'pearson' or 'kendall' or 'similarity' or 'distance'. Default is 'spearman'.
-        The method to calculate the similarities.
-        If method='spearman', calculate the Spearman Correlations. If method='pearson', calculate the Pearson
-        Correlations. If methd='kendall', calculate the Kendall tau Correlations. If method='similarity', calculate the
-        Cosine Similarities. If method='distance', calculate the Euclidean Distances.
+    rdms : array
+        The RDMs of all subjects.
+        The shape must be [n_subs, ..., n_cons, n_cons], such as the output of eegRDM(sub_opt=1, time_opt=1), whose
+        shape is [n_subs, int((n_ts-time_win)/time_step)+1, n_cons, n_cons].
+    method : string 'spearman' or 'pearson'. Default is 'spearman'.
+        The method to calculate the correlations.
+        If method='spearman', each subject's values above the diagonal are ranked before the calculation.
     rescale : bool True or False.
         Rescale the values in RDM or not.
         Here, the maximum-minimum method is used to rescale the values except for the values on the diagonal.
 
     Returns
     -------
-    corrs : array
-        The similarities between fMRI searchlight RDMs and a demo RDM
-        The shape of RDMs is [n_x, n_y, n_z, 2]. n_x, n_y, n_z represent the number of calculation units for searchlight
-        along the x, y, z axis and 2 represents a r-value and a p-value.
+    noise_ceiling : array [..., 2].
+        The noise ceiling. 2 represents the lower bound and the upper bound.
+        The lower bound is the average correlation between each subject's RDM and the average RDM of the other subjects
+        (leave-one-subject-out). The upper bound is the average correlation between each subject's RDM and the average
+        RDM of all subjects.
+
+    Notes
+    -----
+    Each subject's (ranked) vectors are normalized once and the average RDMs are the averages of these normalized
+    vectors. All leave-one-subject-out correlations are derived from the running total of the subjects, so the cost is
+    linear in the number of subjects.
     """
-    # calculate the number of the calculation units in the x, y, z directions
-    n_x = np.shape(fmri_rdms)[0]
-    n_y = np.shape(fmri_rdms)[1]
-    n_z = np.shape(fmri_rdms)[2]
 
-    # initialize the corrs
-    corrs = np.full([n_x, n_y, n_z, 2], np.nan)
-
-    # calculate the corrs
-    for i in range(n_x):
-        for j in range(n_y):
-            for k in range(n_z):
-
-                if method == "spearman":
-                    corrs[i, j, k] = rdm_correlation_spearman(demo_rdm, fmri_rdms[i, j, k], rescale=rescale)
-                elif method == "pearson":
-                    corrs[i, j, k] = rdm_correlation_pearson(demo_rdm, fmri_rdms[i, j, k], rescale=rescale)
-                elif method == "kendall":
-                    corrs[i, j, k] = rdm_correlation_kendall(demo_rdm, fmri_rdms[i, j, k], rescale=rescale)
-                elif method == "similarity":
-                    corrs[i, j, k, 0] = rdm_similarity(demo_rdm, fmri_rdms[i, j, k], rescale=rescale)
-                elif method == "distance":
-                    corrs[i, j, k, 0] = rdm_distance(demo_rdm, fmri_rdms[i, j, k], rescale=rescale)
-
-                print(corrs[i, j, k])
-
-    return np.abs(corrs)
\ No newline at end of file
+    if method != "spearman" and method != "pearson":
+        print("the method for the noise ceiling must be 'spearman' or 'pearson'")
+        return None
+
+    # get the normalized vectors of all subjects: [n_subs, ..., n_values]
+    z = rdm_vectors(rdms, method=method, rescale=rescale)
+
+    # get the number of subjects
+    subs = z.shape[0]
+
+    # the total of all subjects
+    total = np.sum(z, axis=0)
+
+    # the dot products between each subject and the total & the squared norm of the total
+    dots = np.einsum("s...p,...p->s...", z, total)
+    norm2 = np.sum(np.square(total), axis=-1)
+
+    # initialize the noise ceiling
+    noise_ceiling = np.zeros(z.shape[1:-1] + (2,), dtype=np.float64)
+
+    # the lower bound: corr(z_s, total - z_s) = (z_s*total - 1) / |total - z_s|
+    noise_ceiling[..., 0] = np.sum((dots - 1) / np.sqrt(np.maximum(norm2 - 2*dots + 1, 0)), axis=0) / subs
+
+    # the upper bound: corr(z_s, total) = z_s*total / |total|
+    noise_ceiling[..., 1] = np.sum(dots / np.sqrt(norm2), axis=0) / subs
+
+    return noise_ceiling
+
+
+' a function for calculating the bootstrap confidence intervals of the Correlation Cosfficients between RDMs and a demo RDM '
+
+def rdms_corr_bootstrap(demo_rdm, rdms, method="spearman", n_boot=1000, ci=0.95, seed=None, n_jobs=1, mem_budget=2**28):
+
+    """
+    Calculate the confidence intervals of the Correlations between RDMs and a demo RDM by bootstrapping the conditions
+
+    Parameters
+    ----------
+    demo_rdm : array [n_cons, n_cons]
+        A demo RDM.
+    rdms : array
+        The RDM(s).
+        The shape can be [n_cons, n_cons] or any [..., n_cons, n_cons].
+    method : string 'spearman' or 'pearson'. Default is 'spearman'.
+        The method to calculate the correlations.
+    n_boot : int. Default is 1000.
+        The number of bootstrap samples.
+    ci : float. Default is 0.95.
+        The confidence level of the intervals.
+    seed : int or None. Default is None.
+        The seed of the random number generator for reproducible bootstrap samples.
+    n_jobs : int. Default is 1.
+        The number of threads used to evaluate the blocks of bootstrap samples.
+    mem_budget : int. Default is 2**28 (256 MB).
+        The approximate memory budget in bytes for each block of bootstrap samples.
+
+    Returns
+    -------
+    cis : array [..., 2].
+        The confidence intervals. 2 represents the lower bound and the upper bound.
+
+    Notes
+    -----
+    Each bootstrap sample draws n_cons conditions with replacement and re-indexes both RDMs. The pairs of a condition
+    with its own copy are excluded. The resampled upper-triangle indices of all samples are built at once, and the
+    samples & the stack of RDMs are evaluated block by block within mem_budget.
+    """
+
+    if method != "spearman" and method != "pearson":
+        print("the method for the bootstrap must be 'spearman' or 'pearson'")
+        return None
+
+    demo_rdm = np.asarray(demo_rdm, dtype=np.float64)
+    rdms = np.asarray(rdms)
+
+    # get the number of conditions & the number of values above the diagonal
+    cons = demo_rdm.shape[-1]
+    n = int(cons*(cons-1)/2)
+
+    # flatten the RDMs: [..., n_cons, n_cons] -> [n_rdms, n_cons*n_cons]
+    shape = rdms.shape[:-2]
+    flat_rdms = np.reshape(rdms, [-1, cons*cons])
+    flat_demo = np.reshape(demo_rdm, [cons*cons])
+    n_rdms = flat_rdms.shape[0]
+
+    # draw the conditions of all bootstrap samples
+    boot_cons = np.random.RandomState(seed).randint(0, cons, size=[n_boot, cons])
+
+    # the resampled indices of the values above the diagonal: [n_boot, n]
+    i, j = np.triu_indices(cons, k=1)
+    bi, bj = boot_cons[:, i], boot_cons[:, j]
+    indices = bi*cons + bj
+    masks = bi != bj
+
+    # the number of bootstrap samples & the number of RDMs in each block
+    # each resampled value costs a few float64 copies
+    block = max(1, int(mem_budget / (8 * 4 * n * (n_rdms + 1))))
+    rdm_block = max(1, int(mem_budget / (8 * 4 * n * block)))
+
+    def boot_block(starts):
+
+        start, r0 = starts
+        idx = indices[start:start+block]
+        mask = masks[start:start+block]
+
+        # the resampled values: [b, n] & [r, b, n]
+        v1 = flat_demo[idx]
+        v2 = flat_rdms[r0:r0+rdm_block, idx].astype(np.float64)
+
+        if method == "spearman":
+            # the excluded pairs are set to inf, so the valid values are ranked among themselves
+            v1 = rank_vectors(np.where(mask, v1, np.inf))
+            v2 = rank_vectors(np.where(mask, v2, np.inf))
+
+        # center the valid values
+        k = np.sum(mask, axis=-1, keepdims=True)
+        v1 = np.where(mask, v1 - np.sum(np.where(mask, v1, 0), axis=-1, keepdims=True)/k, 0)
+        v2 = np.where(mask, v2 - np.sum(np.where(mask, v2, 0), axis=-1, keepdims=True)/k, 0)
+
+        # calculate the correlations: [b, r]
+        num = np.sum(v1*v2, axis=-1)
+        denom = np.sqrt(np.sum(np.square(v1), axis=-1) * np.sum(np.square(v2), axis=-1))
+
+        return (num / denom).T
+
+    starts = [(start, r0) for start in range(0, n_boot, block) for r0 in range(0, n_rdms, rdm_block)]
+
+    # evaluate the blocks
+    if n_jobs == 1:
+        blocks = [boot_block(start) for start in starts]
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            blocks = list(executor.map(boot_block, starts))
+
+    # assemble the blocks: [n_boot, n_rdms]
+    rs = np.zeros([n_boot, n_rdms], dtype=np.float64)
+    for (start, r0), r in zip(starts, blocks):
+        rs[start:start+block, r0:r0+rdm_block] = r
+
+    # calculate the confidence intervals
+    alpha = (1 - ci) / 2 * 100
+    cis = np.nanpercentile(rs, [alpha, 100 - alpha], axis=0).T
+
+    # RDMs including NaN
+    cis[np.isnan(flat_rdms).any(axis=-1)] = np.nan
+
+    return np.reshape(cis, shape + (2,))
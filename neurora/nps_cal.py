@@ -7,13 +7,29 @@ __author__ = 'Zitong Lu'
 import numpy as np
 from scipy.stats import pearsonr
 import math
+from neurora.stuff import get_windows, normalize_vectors, corr_pvalue, box_sums
 
 np.seterr(divide='ignore', invalid='ignore')
 
 
+' a function for getting the pairs of conditions for calculating the NPS '
+
+def _contrast_pairs(cons, contrasts):
+
+    # the default contrast: condition 0 vs. condition 1
+    if contrasts is None:
+        return [(0, 1)]
+
+    # all pairs of conditions
+    if contrasts == "all":
+        return [(i, j) for i in range(cons) for j in range(i+1, cons)]
+
+    return [(int(i), int(j)) for i, j in contrasts]
+
+
 ' a function for calculating the neural pattern similarity for EEG-like data '
 
-def nps(data, time_win=5, time_step=5, sub_opt=0):
+def nps(data, time_win=5, time_step=5, sub_opt=0, contrasts=None):
 
     """
     Calculate the Neural Representational Similarity (NPS) for EEG-like data
@@ -22,9 +38,10 @@ def nps(data, time_win=5, time_step=5, sub_opt=0):
     ----------
     data : array
         The EEG-like neural data.
-        The shape of data must be [2, n_subs, n_trials, n_chls, n_ts].
-        2 presents 2 different conditions. n_subs, n_trials, n_chls & n_ts represent the number of subjects,
+        The shape of data must be [n_cons, n_subs, n_trials, n_chls, n_ts].
+        n_cons, n_subs, n_trials, n_chls & n_ts represent the number of conditions, the number of subjects,
         the number of trials, the number of channels & the number of time-points, respectively.
+        If contrasts=None, n_cons must be 2, which presents 2 different conditions.
     time_win : int. Default is 5.
         Set a time-window for calculating the NPS for different time-points.
         If time_win=5, that means each calculation process based on 5 time-points.
@@ -34,6 +51,11 @@ def nps(data, time_win=5, time_step=5, sub_opt=0):
         Calculate the NPS for each subject or not.
         If sub_opt=0, calculate the NPS based on all data.
         If sub_opt=1, calculate the NPS based on each subject's data
+    contrasts : None or list of (i, j) or 'all'. Default is None.
+        The pairs of conditions for calculating the NPS.
+        If contrasts=None, calculate the NPS between condition 0 and condition 1.
+        If contrasts is a list of (i, j), calculate the NPS between condition i and condition j for each pair.
+        If contrasts='all', calculate the NPS for all n_cons*(n_cons-1)/2 pairs of conditions.
 
     Returns
     -------
@@ -42,62 +64,63 @@ def nps(data, time_win=5, time_step=5, sub_opt=0):
         If sub_opt=0, the shape of NPS is [n_chls, int((n_ts-time_win)/time_step)+1, 2].
         If sub_opt=1, the shape of NPS is [n_subs, n_chls, int((n_ts-time_win)/time_step)+1, 2].
         2 representation a r-value and a p-value.
+        If contrasts is not None, the shape of NPS has a leading axis of n_pairs: [n_pairs, ...].
     """
 
-    # get the number of subjects, trials, channels & time-points
-    nsubs, ntrials, nchls, nts = data.shape[1:]
+    # get the number of conditions, subjects, trials, channels & time-points
+    ncons, nsubs, ntrials, nchls, nts = data.shape
+
+    # get the pairs of conditions
+    pairs = _contrast_pairs(ncons, contrasts)
+
+    # only average the conditions used
+    used = sorted(set([i for pair in pairs for i in pair]))
+    index = dict([(con, i) for i, con in enumerate(used)])
 
-    # average the trials
-    avgdata = np.average(data, axis=2)
+    # average the trials condition by condition, so the raw data of the used conditions are never copied
+    avgdata = np.array([np.average(data[i], axis=1) for i in used])
 
-    # the time-points for calculating NPS
-    ts = int((nts-time_win)/time_step)+1
+    # the time-windows for calculating NPS
+    # shape of windows: [n_used, n_subs, n_chls, n_ts] -> [n_used, n_subs, n_chls, ts, time_win]
+    windows = get_windows(avgdata, time_win=time_win, time_step=time_step)
+    ts = windows.shape[3]
 
     # sub_opt=1
     if sub_opt == 1:
 
-        # initialize the NPS
-        nps = np.zeros([nsubs, nchls, ts, 2])
+        # the feature vectors of each subject: [n_used, n_subs, n_chls, ts, time_win]
+        vectors = windows
 
-        # calculate the NPS
-        for sub in range(nsubs):
-            for i in range(nchls):
-                for j in range(ts):
-
-                    # average the time_win
-                    data1 = avgdata[0, sub, i, j*time_win:j*time_win+time_win]
-                    data2 = avgdata[1, sub, i, j*time_win:j*time_win+time_win]
-                    # calculate the Pearson Coefficient
-                    nps[sub, i, j] = pearsonr(data1, data2)
+    # if sub_opt == 0
+    else:
 
-        return nps
+        # flatten the data of all subjects
+        # shape of vectors: [n_used, n_subs, n_chls, ts, time_win] -> [n_used, n_chls, ts, n_subs, time_win]
+        #                   -> [n_used, n_chls, ts, n_subs*time_win]
+        vectors = np.transpose(windows, (0, 2, 3, 1, 4))
+        vectors = np.reshape(vectors, [len(used), nchls, ts, nsubs*time_win])
 
-    # if sub_opt == 0
+    # normalize the feature vectors of each condition once
+    vectors = normalize_vectors(vectors)
 
     # initialize the NPS
-    nps = np.zeros([nchls, ts, 2])
-
-    # calculate the NPS
-    for i in range(nchls):
-        for j in range(ts):
+    nps = np.zeros((len(pairs),) + vectors.shape[1:-1] + (2,), dtype=np.float64)
 
-            # average the time_win
-            data1 = avgdata[0, :, i, j*time_win:j*time_win+time_win]
-            data2 = avgdata[1, :, i, j*time_win:j*time_win+time_win]
+    # calculate the Pearson Coefficients
+    for k, (i, j) in enumerate(pairs):
+        nps[k, ..., 0] = np.sum(vectors[index[i]]*vectors[index[j]], axis=-1)
 
-            # flatten the data
-            data1 = np.reshape(data1, nsubs*time_win)
-            data2 = np.reshape(data2, nsubs*time_win)
+    nps[..., 1] = corr_pvalue(nps[..., 0], vectors.shape[-1])
 
-            # calculate the Pearson Coefficient
-            nps[i, j] = pearsonr(data1, data2)
+    if contrasts is None:
+        return nps[0]
 
     return nps
 
 
 ' a function for calculating the neural pattern similarity for fMRI data (searchlight) '
 
-def nps_fmri(fmri_data, ksize=[3, 3, 3], strides=[1, 1, 1]):
+def nps_fmri(fmri_data, ksize=[3, 3, 3], strides=[1, 1, 1], contrasts=None):
 
     """
     Calculate the Neural Representational Similarity (NPS) for fMRI data (searchlight)
@@ -109,11 +132,17 @@ def nps_fmri(fmri_data, ksize=[3, 3, 3], strides=[1, 1, 1]):
         The shape of fmri_data must be [n_cons, n_chls, nx, ny, nz].
         n_cons, n_chls, nx, ny, nz represent the number of conidtions, the number of channels &
         the size of fMRI-img, respectively.
+        If contrasts=None, n_cons must be 2.
     ksize : array or list [kx, ky, kz]. Default is [3, 3, 3].
         The size of the fMRI-img.
         nx, ny, nz represent the number of voxels along the x, y, z axis.
     strides : array or list [sx, sy, sz]. Default is [1, 1, 1].
         The strides for calculating along the x, y, z axis.
+    contrasts : None or list of (i, j) or 'all'. Default is None.
+        The pairs of conditions for calculating the NPS.
+        If contrasts=None, calculate the NPS between condition 0 and condition 1.
+        If contrasts is a list of (i, j), calculate the NPS between condition i and condition j for each pair.
+        If contrasts='all', calculate the NPS for all n_cons*(n_cons-1)/2 pairs of conditions.
 
     Returns
     -------
@@ -121,61 +150,70 @@ def nps_fmri(fmri_data, ksize=[3, 3, 3], strides=[1, 1, 1]):
         The fMRI NPS for searchlight.
         The shape of NPS is [n_x, n_y, n_z, 2]. n_x, n_y, n_z represent the number of calculation units
         for searchlight along the x, y, z axis.
+        If contrasts is not None, the shape of NPS is [n_pairs, n_x, n_y, n_z, 2].
+
+    Notes
+    -----
+    The local sums of x, y, x^2, y^2 & xy are calculated by 3-D summed-area tables, so the cost does not depend on the
+    size of the calculation units. The sums of x & x^2 are calculated once for each condition, and only the sums of
+    xy are calculated for each pair.
     """
 
-    # get the number of subjects and the size of the fMRI-img
-    nsubs, nx, ny, nz = np.shape(fmri_data)[1:]
+    # get the number of conditions & subjects
+    ncons, nsubs = np.shape(fmri_data)[:2]
 
-    # the size of the calculation units for searchlight
-    kx = ksize[0]
-    ky = ksize[1]
-    kz = ksize[2]
+    # get the pairs of conditions
+    pairs = _contrast_pairs(ncons, contrasts)
 
-    # strides for calculating along the x, y, z axis
-    sx = strides[0]
-    sy = strides[1]
-    sz = strides[2]
+    # the number of values in a calculation unit
+    n = ksize[0]*ksize[1]*ksize[2]*nsubs
 
-    # calculate the number of the calculation units
-    n_x = int((nx - kx) / sx) + 1
-    n_y = int((ny - ky) / sy) + 1
-    n_z = int((nz - kz) / sz) + 1
+    # the local statistics of each condition
+    data = {}
+    nans = {}
+    s = {}
+    ss = {}
+    nan_counts = {}
 
-    # initialize the data for calculating the NPS
-    data = np.full([n_x, n_y, n_z, 2, kx*ky*kz, nsubs], np.nan)
+    for i in sorted(set([i for pair in pairs for i in pair])):
 
-    # assignment
-    for x in range(n_x):
-        for y in range(n_y):
-            for z in range(n_z):
-                for i in range(2):
+        # record the NaN values and set them to 0
+        data[i] = np.array(fmri_data[i], dtype=np.float64)
+        nans[i] = np.isnan(data[i])
+        data[i][nans[i]] = 0
 
-                    # record the index in a calculation unit
-                    index = 0
+        # subtract the global mean for numerical stability (the correlations are not changed)
+        data[i] -= np.sum(data[i]) / np.sum(~nans[i])
+        data[i][nans[i]] = 0
 
-                    for k1 in range(kx):
-                        for k2 in range(ky):
-                            for k3 in range(kz):
-                                for j in range(nsubs):
-                                    data[x, y, z, i, index, j] = fmri_data[i, j, x+k1, y+k2, z+k3]
+        # the local sums of x & x^2 in each calculation unit, folding the subjects into the sums
+        s[i] = box_sums(np.sum(data[i], axis=0), ksize, strides)
+        ss[i] = box_sums(np.sum(data[i]*data[i], axis=0), ksize, strides)
+        nan_counts[i] = box_sums(np.sum(nans[i], axis=0), ksize, strides)
 
-                                index = index + 1
+    # initialize the NPS
+    nps = np.full((len(pairs),) + s[pairs[0][0]].shape + (2,), np.nan)
 
-    # flatten the data under each condition for each calculation unit
-    data = np.reshape(data, [n_x, n_y, n_z, 2, kx*ky*kz*nsubs])
+    for k, (i, j) in enumerate(pairs):
 
-    # initialize the NPS
-    nps = np.full([n_x, n_y, n_z, 2], np.nan)
+        # the local sums of xy
+        sij = box_sums(np.sum(data[i]*data[j], axis=0), ksize, strides)
+
+        # calculate the Pearson Coefficients
+        cov = sij - s[i]*s[j]/n
+        vari = np.maximum(ss[i] - s[i]*s[i]/n, 0)
+        varj = np.maximum(ss[j] - s[j]*s[j]/n, 0)
+        r = cov / np.sqrt(vari*varj)
+
+        # no NaN
+        valid = (nan_counts[i] < 0.5) & (nan_counts[j] < 0.5)
 
-    # calculate the NPS
-    for x in range(n_x):
-        for y in range(n_y):
-            for z in range(n_z):
+        # absolute the results
+        nps[k][valid, 0] = np.abs(r[valid])
+        nps[k][valid, 1] = corr_pvalue(r[valid], n)
 
-                # no NaN
-                if (np.isnan(data[x, y, z, 0]).any() == False) and (np.isnan(data[x, y, z, 1]).any() == False):
-                    # calculate the Pearson Coefficient and absolute the result
-                    nps[x, y, z] = np.abs(pearsonr(data[x, y, z, 0], data[x, y, z, 1]))
+    if contrasts is None:
+        return nps[0]
 
     return nps
 
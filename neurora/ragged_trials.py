@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+' a module for storing the trials of neural data with different numbers of trials '
+
+__author__ = 'Zitong Lu'
+
+import numpy as np
+
+
+' a class for the concatenated trials with the offsets of the conditions & the subjects '
+
+class RaggedTrials(object):
+
+    """
+    The trials of all conditions & subjects concatenated in one array, indexed by offsets like CSR
+
+    Parameters
+    ----------
+    trials : array [n_total_trials, ...]
+        The trials of all groups concatenated along the first axis, such as [n_total_trials, n_chls, n_ts].
+        The groups are ordered by conditions, then by subjects: (con 0, sub 0), (con 0, sub 1), ..., (con 1, sub 0), ...
+    sub_offsets : array [n_cons*n_subs+1]
+        The offsets of the groups in trials. The trials of group g are trials[sub_offsets[g]:sub_offsets[g+1]].
+        sub_offsets[0] must be 0 & each group must have at least one trial.
+    con_offsets : array [n_cons+1] or None. Default is None.
+        The offsets of the conditions in the groups. The groups of condition i are con_offsets[i] to con_offsets[i+1].
+        Each condition must have the same number of subjects.
+        If con_offsets=None, each group is a condition (one subject), such as for ECoG/sEEG data.
+
+    Attributes
+    ----------
+    n_cons : int
+        The number of conditions.
+    n_subs : int
+        The number of subjects.
+    counts : array [n_cons, n_subs]
+        The number of trials of each condition & subject.
+
+    Notes
+    -----
+    The trials are never padded or copied: the averages of each group are calculated by np.add.reduceat() over the
+    concatenated trials, which can also be a np.memmap.
+    """
+
+    def __init__(self, trials, sub_offsets, con_offsets=None):
+
+        self.trials = trials
+        self.sub_offsets = np.asarray(sub_offsets, dtype=np.int64)
+
+        n_groups = len(self.sub_offsets) - 1
+
+        if con_offsets is None:
+            con_offsets = np.arange(n_groups+1)
+        self.con_offsets = np.asarray(con_offsets, dtype=np.int64)
+
+        # the number of conditions & subjects
+        subs = np.diff(self.con_offsets)
+        if len(set(subs.tolist())) != 1 or self.con_offsets[-1] != n_groups:
+            raise ValueError("each condition must have the same number of subjects")
+
+        self.n_cons = len(subs)
+        self.n_subs = int(subs[0])
+
+        if self.sub_offsets[0] != 0 or self.sub_offsets[-1] != np.shape(trials)[0]:
+            raise ValueError("sub_offsets must start with 0 & end with the number of trials")
+
+        if (np.diff(self.sub_offsets) < 1).any():
+            raise ValueError("each condition & subject must have at least one trial")
+
+    @classmethod
+    def from_lists(cls, data):
+
+        """
+        Build the container from nested lists
+
+        Parameters
+        ----------
+        data : list
+            data[i][j] is the array of the trials of condition i & subject j, [n_trials_ij, ...].
+
+        Returns
+        -------
+        ragged : RaggedTrials
+        """
+
+        groups = [np.asarray(trials) for con in data for trials in con]
+        sub_offsets = np.concatenate([[0], np.cumsum([len(trials) for trials in groups])])
+        con_offsets = np.concatenate([[0], np.cumsum([len(con) for con in data])])
+
+        return cls(np.concatenate(groups, axis=0), sub_offsets, con_offsets)
+
+    @property
+    def counts(self):
+        return np.reshape(np.diff(self.sub_offsets), [self.n_cons, self.n_subs])
+
+    def __repr__(self):
+        return "RaggedTrials(n_cons=%d, n_subs=%d, n_trials=%d, shape=%s)" % (self.n_cons, self.n_subs,
+                                                                             self.sub_offsets[-1],
+                                                                             np.shape(self.trials)[1:])
+
+    def means(self):
+
+        """
+        Average the trials of each condition & subject
+
+        Returns
+        -------
+        avgdata : array [n_cons, n_subs, ...]
+            The trial-averaged data, such as [n_cons, n_subs, n_chls, n_ts].
+        """
+
+        # the sums of each group by the offsets
+        sums = np.add.reduceat(self.trials, self.sub_offsets[:-1], axis=0, dtype=np.float64)
+        counts = np.diff(self.sub_offsets).astype(np.float64)
+
+        avgdata = sums / np.reshape(counts, [-1] + [1]*(sums.ndim-1))
+
+        return np.reshape(avgdata, [self.n_cons, self.n_subs] + list(avgdata.shape[1:]))
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+' a module for caching the results of RDM calculations on disk '
+
+__author__ = 'Zitong Lu'
+
+import os
+import time
+import hashlib
+import inspect
+import functools
+import numpy as np
+from neurora.rdm_stack import CondensedRDMStack
+from neurora.ragged_trials import RaggedTrials
+
+# the settings of the cache, the cache is disabled if "dir" is None
+_settings = {"dir": None, "max_size": 2**30}
+
+
+' a function for enabling the cache '
+
+def enable_cache(cache_dir="~/.neurora_cache", max_size=2**30):
+
+    """
+    Enable the cache of the results of eegRDM(), fmriRDM() & bhvRDM()
+
+    Parameters
+    ----------
+    cache_dir : string. Default is '~/.neurora_cache'.
+        The directory for storing the cached results.
+    max_size : int. Default is 2**30 (1 GB).
+        The maximum total size in bytes of the cached results.
+        When the size is exceeded, the least recently used results are removed.
+
+    Notes
+    -----
+    A result is keyed on a hash of the bytes of the input data & all parameters (including the defaults), so calling
+    the functions again with identical inputs, e.g. by the functions in corr_cal, reads the result instead of
+    recalculating it.
+    The calls with memory-mapped data (np.memmap, or a RaggedTrials of a np.memmap) are not cached, so the streamed
+    calculations never read the whole file to build a key.
+    """
+
+    cache_dir = os.path.expanduser(cache_dir)
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    _settings["dir"] = cache_dir
+    _settings["max_size"] = int(max_size)
+
+
+' a function for disabling the cache '
+
+def disable_cache():
+
+    """
+    Disable the cache. The cached results are kept on disk.
+    """
+
+    _settings["dir"] = None
+
+
+' a function for removing all cached results '
+
+def clear_cache():
+
+    """
+    Remove all cached results in the directory of the enabled cache
+    """
+
+    for path in _cache_files():
+        os.remove(path)
+
+
+' a function for getting the files of the cached results '
+
+def _cache_files():
+
+    if _settings["dir"] is None:
+        return []
+
+    return [os.path.join(_settings["dir"], name) for name in os.listdir(_settings["dir"]) if name.endswith(".npy")]
+
+
+' a function for calculating the key of a call '
+
+def _cache_key(name, arguments):
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(name.encode())
+
+    for key in sorted(arguments):
+
+        value = arguments[key]
+        h.update(key.encode())
+
+        # the arrays (& the data given as lists) are hashed by their bytes, the others by their representations
+        if isinstance(value, np.ndarray) or (isinstance(value, (list, tuple)) and key.endswith("data")):
+            _hash_array(h, value)
+        elif isinstance(value, RaggedTrials):
+            for array in [value.trials, value.sub_offsets, value.con_offsets]:
+                _hash_array(h, array)
+        else:
+            h.update(repr(value).encode())
+
+    return h.hexdigest()
+
+
+' a function for hashing an array or the nested lists of arrays with different lengths '
+
+def _hash_array(h, value):
+
+    try:
+        value = np.ascontiguousarray(value)
+    except ValueError:
+        # the nested lists with different lengths
+        h.update(("list%d" % len(value)).encode())
+        for item in value:
+            _hash_array(h, item)
+        return
+
+    h.update(str((value.dtype.str, value.shape)).encode())
+    h.update(value.reshape(-1).view(np.uint8))
+
+
+' a function for checking if an argument is memory-mapped data on disk '
+
+def _on_disk(value):
+
+    if isinstance(value, RaggedTrials):
+        value = value.trials
+
+    return isinstance(value, np.memmap)
+
+
+' a function for removing the least recently used results until the cache fits the maximum size '
+
+def _evict():
+
+    files = [(os.path.getmtime(path), os.path.getsize(path), path) for path in _cache_files()]
+    size = sum([f[1] for f in files])
+
+    for mtime, fsize, path in sorted(files):
+
+        if size <= _settings["max_size"]:
+            break
+
+        os.remove(path)
+        size -= fsize
+
+
+' a decorator for caching the results of a RDM function '
+
+def cached(func):
+
+    """
+    Cache the results of a function returning an array or a CondensedRDMStack when the cache is enabled
+    """
+
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+
+        # the results written to disk by the function itself are not cached
+        if _settings["dir"] is None or kwargs.get("store") is not None:
+            return func(*args, **kwargs)
+
+        # bind the arguments with the defaults, so equal calls give equal keys
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+
+        # hashing the data on disk would read all of it, which the streamed calculation avoids
+        if any([_on_disk(value) for value in bound.arguments.values()]):
+            return func(*args, **kwargs)
+
+        key = _cache_key(func.__name__, bound.arguments)
+        path = os.path.join(_settings["dir"], key + ".npy")
+        condensed_path = os.path.join(_settings["dir"], key + ".condensed.npy")
+
+        # read the cached result & mark it as recently used
+        for p in [path, condensed_path]:
+            if os.path.exists(p):
+                try:
+                    result = np.load(p)
+                except (IOError, ValueError):
+                    break
+                os.utime(p, None)
+                if p == condensed_path:
+                    return CondensedRDMStack(result)
+                return result
+
+        result = func(*args, **kwargs)
+
+        # write the result atomically
+        if isinstance(result, CondensedRDMStack):
+            values, p = result.values, condensed_path
+        elif isinstance(result, np.ndarray):
+            values, p = result, path
+        else:
+            return result
+
+        tmp = "%s.%d.%d.tmp" % (p, os.getpid(), int(time.time()*1e6))
+        with open(tmp, "wb") as f:
+            np.save(f, values)
+        os.replace(tmp, p)
+
+        _evict()
+
+        return result
+
+    return wrapper
@@ -5,16 +5,21 @@
 __author__ = 'Zitong Lu'
 
 import numpy as np
-from neurora.stuff import limtozero
 import math
-from scipy.stats import pearsonr
+from neurora.stuff import get_windows, get_patches, normalize_vectors, corr_pvalue, get_upper, sparse_projection, \
+    jl_distortion
+from neurora.rdm_stack import CondensedRDMStack, RDMBatches
+from neurora.rdm_store import RDMStore
+from neurora.rdm_cache import cached
+from neurora.ragged_trials import RaggedTrials
 
 np.seterr(divide='ignore', invalid='ignore')
 
 
 ' a function for calculating the RDM(s) based on behavioral data '
 
-def bhvRDM(bhv_data, sub_opt=0):
+@cached
+def bhvRDM(bhv_data, sub_opt=0, offsets=None):
 
     """
     Calculate the Representational Dissimilarity Matrix(Matrices) - RDM(s) for behavioral data
@@ -26,10 +31,16 @@ def bhvRDM(bhv_data, sub_opt=0):
         The shape of bhv_data must be [n_cons, n_subs, n_trials].
         n_cons, n_subs & n_trials represent the number of conidtions, the number of subjects & the number of trials,
         respectively.
+        The subjects can have different numbers of trials: bhv_data can be a nested list whose bhv_data[i][j] is the
+        trials of condition i of subject j, or an array [n_cons, n_total_trials] with offsets.
     sub_opt : int 0 or 1. Default is 0.
         Calculate the RDM for each subject or not.
         If sub_opt=0, return only one RDM based on all data.
         If sub_opt=1, return n_subs RDMs based on each subject's data.
+    offsets : array or None. Default is None.
+        The offsets of the subjects' trials in bhv_data of the shape [n_cons, n_total_trials].
+        The trials of subject j are bhv_data[:, offsets[j]:offsets[j+1]], so the shape of offsets is [n_subs+1] with
+        offsets[0]=0 & offsets[n_subs]=n_total_trials. Each subject must have at least one trial.
 
     Returns
     -------
@@ -41,92 +52,98 @@ def bhvRDM(bhv_data, sub_opt=0):
     Notes
     -----
     This function can also be used to calculate the RDM for computational simulation data
+    The RDM(s) are calculated by one matrix product of the normalized patterns. With different numbers of trials,
+    the trials of all subjects are concatenated & reduced segment by segment with the offsets, without padding.
     """
 
-    # get the number of conditions & the number of subjects
-    cons = len(bhv_data)
+    # the data of subjects with different numbers of trials: concatenate the trials & get the offsets
+    if offsets is None:
+        try:
+            bhv_data = np.asarray(bhv_data, dtype=np.float64)
+        except ValueError:
+            bhv_data, offsets = _concatenate_trials(bhv_data)
+            if bhv_data is None:
+                print("the numbers of trials of different conditions must be the same for each subject")
+                return None
 
-    # get the number of conditions
-    n_subs = []
+    # the same numbers of trials: [n_cons, n_subs, n_trials]
+    if offsets is None:
 
-    for i in range(cons):
-        n_subs.append(np.shape(bhv_data[i])[0])
+        if sub_opt == 1:
+            # the patterns of each subject: [n_subs, n_cons, n_trials]
+            return patternRDM(np.transpose(bhv_data, (1, 0, 2)))
 
-    subs = n_subs[0]
+        # the patterns of the trial-averaged data: [n_cons, n_subs]
+        return patternRDM(np.average(bhv_data, axis=2))
 
-    # shape of bhv_data: [N_cons, N_subs, N_trials]
+    bhv_data = np.asarray(bhv_data, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
 
-    # save the number of trials of each condition
-    n_trials = []
+    # the numbers of trials of each subject
+    starts = offsets[:-1]
+    counts = np.diff(offsets)
 
-    for i in range(cons):
-        n_trials.append(np.shape(bhv_data[i])[1])
+    # the averages of the trials of each subject: [n_cons, n_subs]
+    avgs = np.add.reduceat(bhv_data, starts, axis=1) / counts
 
-    # save the number of trials of each condition
-    if len(set(n_trials)) != 1:
-            return None
+    if sub_opt == 0:
+        return patternRDM(avgs)
 
-    # sub_opt=1
+    # center & normalize the trials of each subject
+    x = bhv_data - np.repeat(avgs, counts, axis=1)
+    norms = np.sqrt(np.add.reduceat(x*x, starts, axis=1))
+    z = x / np.repeat(norms, counts, axis=1)
 
-    if sub_opt == 1:
-
-        # initialize the RDMs
-        rdms = np.zeros([subs, cons, cons], dtype=np.float64)
+    # the Pearson Coefficients of each subject by the segment sums of the products: [n_subs, n_cons, n_cons]
+    cons = bhv_data.shape[0]
+    r = np.zeros([len(counts), cons, cons], dtype=np.float64)
+    for i in range(cons):
+        r[:, i] = np.add.reduceat(z[i]*z, starts, axis=1).T
 
-        # calculate the values in RDMs
-        for sub in subs:
-            for i in range(cons):
-                for j in range(cons):
-                    # calculate the Pearson Coefficient
-                    r = pearsonr(bhv_data[i][sub], bhv_data[j][sub])[0]
-                    # calculate the dissimilarity
-                    rdms[sub, i, j] = limtozero(1 - abs(r))
+    # calculate the dissimilarities
+    rdms = 1 - np.abs(r)
+    rdms[rdms < 1e-15] = 0
 
-        return rdms
+    return rdms
 
-    # & sub_opt=0
 
-    # initialize the RDM
-    rdm = np.zeros([cons, cons], dtype=np.float64)
+' a function for concatenating the trials of behavioral data with different numbers of trials '
 
-    # judge whether numbers of trials of different conditions are same
-    if len(set(n_subs)) != 1:
-        return None
+def _concatenate_trials(bhv_data):
 
-    # initialize the data for calculating the RDM
-    data = np.zeros([cons, subs], dtype=np.float64)
+    # the numbers of trials of each subject: [n_subs]
+    counts = [len(trials) for trials in bhv_data[0]]
 
-    # assignment
-    for i in range(cons):
-        for j in range(subs):
-            # save the data for each subject under each condition, average the trials
-            data[i][j] = np.average(bhv_data[i][j])
+    for con in bhv_data:
+        if [len(trials) for trials in con] != counts:
+            return None, None
 
-    # calculate the values in RDM
-    for i in range(cons):
-        for j in range(cons):
-            # calculate the Pearson Coefficient
-            r = pearsonr(data[i], data[j])[0]
-            # calculate the dissimilarity
-            rdm[i, j] = limtozero(1 - abs(r))
+    # [n_cons, n_total_trials] & [n_subs+1]
+    data = np.array([np.concatenate([np.asarray(trials, dtype=np.float64) for trials in con]) for con in bhv_data])
+    offsets = np.concatenate([[0], np.cumsum(counts)])
 
-    return rdm
+    return data, offsets
 
 
 ' a function for calculating the RDM(s) based on EEG/MEG/fNIRS data '
 
-def eegRDM(EEG_data, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5):
+@cached
+def eegRDM(EEG_data, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5, condensed=False, store=None,
+           mem_budget=None, approx=False, n_components=1024, seed=0):
 
     """
     Calculate the Representational Dissimilarity Matrix(Matrices) - RDM(s) for EEG/MEG/fNIRS data
 
     Parameters
     ----------
-    EEG_data : array
+    EEG_data : array or RaggedTrials
         The EEG/MEG/fNIRS data.
         The shape of EEGdata must be [n_cons, n_subs, n_trials, n_chls, n_ts].
         n_cons, n_subs, n_trials, n_chls & n_ts represent the number of conidtions, the number of subjects, the number
         of trials, the number of channels & the number of time-points, respectively.
+        With different numbers of trials, EEG_data can be a RaggedTrials of the trials [n_total_trials, n_chls, n_ts]
+        with the offsets of the conditions & subjects. The trials are averaged by the offsets without padding in one
+        pass, so mem_budget does not work (a message is printed & the budget is ignored).
     sub_opt : int 0 or 1. Default is 0.
         Calculate the RDM for each subject or not.
         If sub_opt=0, return only one RDM based on all data.
@@ -139,17 +156,45 @@ def eegRDM(EEG_data, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5):
         Calculate the RDM for each time-point or not
         If time_opt=0, calculate the RDM based on whole time-points' data.
         If time_opt=1, calculate the RDMs based on each time-points respectively.
-    time_win : int. Default is 5.
+    time_win : int or list of int. Default is 5.
         Set a time-window for calculating the RDM for different time-points.
         Only when time_opt=1, time_win works.
         If time_win=5, that means each calculation process based on 5 time-points.
+        If time_win is a list of int, return a list of the RDMs for each width of time-windows. The widths share one
+        pass of prefix sums along the time.
     time_step : int. Default is 5.
         The time step size for each time of calculating.
         Only when time_opt=1, time_step works.
+        If time_step < time_win, the statistics of the overlapping time-windows are calculated from prefix sums along
+        the time, so each time-window costs the same whatever time_win is.
+    condensed : bool True or False. Default is False.
+        Return the RDM(s) as a CondensedRDMStack, which stores only the values above the diagonal, or not.
+    store : string or None. Default is None.
+        The path of a .npy file for storing the RDMs on disk.
+        If store is not None, the RDMs are written to the file chunk by chunk along the first axis (as float32,
+        condensed if condensed=True) and an RDMStore is returned, so the RDMs never need to fit in the memory.
+    mem_budget : int or None. Default is None.
+        The approximate memory budget in bytes for streaming the data.
+        If EEG_data is a np.memmap or mem_budget is not None, the data are read block by block of channels (and trials)
+        within the budget (2**28 bytes, 256 MB, if mem_budget=None), each block is read once & averaged over the
+        trials, and the RDM(s) are accumulated block by block. So EEG_data never needs to fit in the memory.
+        If chl_opt=0 & time_opt=0, the features are chunked over channels & time-points, and only the sums, the sums
+        of squares & the [n_cons, n_cons] cross-products of the patterns are accumulated, so the memory does not
+        depend on the number of features and the flattened patterns are never held.
+    approx : bool True or False. Default is False.
+        Calculate the approximate RDM(s) by a seeded very sparse random projection of the patterns or not.
+        If approx=True, the features of each pattern are projected chunk by chunk to n_components dimensions before
+        the correlations, and the bound on the distortion is returned with the RDM(s). Only about sqrt(n_features)
+        entries of each component are nonzero, so the projection costs O(n_cons*sqrt(n_features)*n_components).
+        If the patterns have no more features than n_components, they are not projected and the RDM(s) are exact.
+    n_components : int. Default is 1024.
+        The number of dimensions after the random projection. Only when approx=True, n_components works.
+    seed : int. Default is 0.
+        The seed of the random projection. Only when approx=True, seed works.
 
     Returns
     -------
-    RDM(s) : array
+    RDM(s) : array or CondensedRDMStack or RDMStore
         The EEG/MEG/fNIR RDM.
         If sub_opt=0 & chl_opt=0 & time_opt=0, return only one RDM.
             The shape is [n_cons, n_cons].
@@ -167,290 +212,956 @@ def eegRDM(EEG_data, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5):
             The shape is [n_subs, n_chls, n_cons, n_cons].
         If sub_opt=1 & chl_opt=1 & time_opt=1, return n_subs*n_chls*(int((n_ts-time_win)/time_step)+1) RDM.
             The shape is [n_subs, n_chls, int((n_ts-time_win)/time_step)+1, n_cons, n_cons].
+        If condensed=True, the last two axes [n_cons, n_cons] are replaced by the stored values above the diagonal.
+        If store is not None, return the read-only RDMStore with the leading axes of the shapes above.
+    eps : float
+        Only when approx=True, return (RDM(s), eps). eps is the Johnson-Lindenstrauss bound on the distortion: with
+        probability at least 1 - 1/n_cons, the squared distances between the centered patterns of each RDM are
+        preserved within a factor of (1 - eps, 1 + eps). See jl_distortion(). If the patterns are not projected, eps=0.
     """
 
-    # get the number of conditions, subjects, trials, channels and time points
-    cons, subs, trials, chls, ts = np.shape(EEG_data)
+    if time_opt == 1 and _valid_windows(EEG_data, time_win, time_step) == False:
+        return None
 
-    if sub_opt == 1:
+    # the ragged trials are averaged by the offsets in one pass, without streaming
+    if isinstance(EEG_data, RaggedTrials) and mem_budget is not None:
+        print("mem_budget does not work with RaggedTrials, the trials are averaged in one pass")
+        mem_budget = None
 
-        if time_opt == 1:
+    # several widths of time-windows
+    if time_opt == 1 and isinstance(time_win, (list, tuple)):
 
-            # the time-points for calculating RDM
-            ts = int((ts-time_win)/time_step)+1
+        if store is not None:
+            print("store does not support several widths of time-windows")
+            return None
 
-            if chl_opt == 1:
+        if approx == True or _streamed(EEG_data, mem_budget):
+            return [eegRDM(EEG_data, sub_opt=sub_opt, chl_opt=chl_opt, time_opt=time_opt, time_win=w,
+                           time_step=time_step, condensed=condensed, mem_budget=mem_budget, approx=approx,
+                           n_components=n_components, seed=seed) for w in time_win]
 
-                # sub_opt=1 & time_opt=1 & chl_opt=1
+        # all widths in one pass of prefix sums
+        avgdata = _average_trials(EEG_data)
+        rdms = _window_rdms(_time_patterns(avgdata, sub_opt, chl_opt), list(time_win), time_step)
+        if condensed == True:
+            return [CondensedRDMStack(get_upper(rdm)) for rdm in rdms]
+        return rdms
 
-                # initialize the data for calculating the RDM
-                data = np.zeros([subs, chls, ts, cons, time_win], dtype=np.float64)
+    # the patterns are only projected if they have more features than n_components
+    project = approx == True and _n_features(EEG_data, sub_opt, chl_opt, time_opt, time_win) > n_components
 
-                # assignment
-                for i in range(subs):
-                    for j in range(chls):
-                        for k in range(ts):
-                            for l in range(cons):
-                                for m in range(time_win):
-                                    # average the trials
-                                    data[i, j, k, l, m] = np.average(EEG_data[l, i, :, j, k * time_win + m])
+    # the function for the RDM(s) of patterns: exact, or approximate by a random projection
+    calRDM = _rdm_function(project, n_components, seed)
 
-                # initialize the RDMs
-                rdms = np.zeros([subs, chls, ts, cons, cons], dtype=np.float64)
+    # stream the data on disk
+    if _streamed(EEG_data, mem_budget):
+        if mem_budget is None:
+            mem_budget = 2**28
+        rdms = _eegRDM_stream(EEG_data, sub_opt, chl_opt, time_opt, time_win, time_step, condensed, store,
+                              mem_budget, calRDM, project, n_components, seed)
+    else:
+        rdms = _eegRDM_memory(EEG_data, sub_opt, chl_opt, time_opt, time_win, time_step, condensed, store, calRDM)
 
-                # calculate the values in RDMs
-                for i in range(subs):
-                    for j in range(chls):
-                        for k in range(ts):
-                            for l in range(cons):
-                                for m in range(cons):
-                                    # calculate the Pearson Coefficient
-                                    r = pearsonr(data[i, j, k, l], data[i, j, k, m])[0]
-                                    # calculate the dissimilarity
-                                    rdms[i, j, k, l, m] = limtozero(1 - abs(r))
+    if approx == True and project == False:
+        return rdms, 0.0
+    elif approx == True:
+        n_cons = EEG_data.n_cons if isinstance(EEG_data, RaggedTrials) else np.shape(EEG_data)[0]
+        return rdms, jl_distortion(n_cons, n_components)
 
-                return rdms
+    return rdms
 
-            # sub_opt=1 & time_opt=1 & chl_opt=0
 
-            # initialize the data for calculating the RDM
-            data = np.zeros([subs, ts, cons, chls, time_win], dtype=np.float64)
+' a function for averaging the trials of dense or ragged data '
 
-            # assignment
-            for i in range(subs):
-                for j in range(ts):
-                    for k in range(cons):
-                        for l in range(chls):
-                            for m in range(time_win):
-                                # average the trials
-                                data[i, j, k, l, m] = np.average(EEG_data[k, i, :, l, j * time_win + m])
+def _average_trials(data, axis=2):
 
-            # flatten the data for different calculating conditions
-            data = np.reshape(data, [subs, ts, cons, chls * time_win])
+    # the ragged trials: averaged group by group by the offsets
+    if isinstance(data, RaggedTrials):
 
-            # initialize the RDMs
-            rdms = np.zeros([subs, ts, cons, cons], dtype=np.float64)
+        avgdata = data.means()
 
-            # calculate the values in RDMs
-            for i in range(subs):
-                for j in range(ts):
-                    for k in range(cons):
-                        for l in range(cons):
-                            # calculate the Pearson Coefficient
-                            r = pearsonr(data[i, j, k], data[i, j, l])[0]
-                            # calculate the dissimilarity
-                            rdms[i, j, k, l] = limtozero(1 - abs(r))
+        # the data without subjects: [n_cons, 1, ...] -> [n_cons, ...]
+        if axis == 1:
+            if data.n_subs != 1:
+                raise ValueError("the ragged trials must have one group for each condition")
+            return avgdata[:, 0]
 
-            return rdms
+        return avgdata
 
-        # if time_opt = 0
+    return np.average(data, axis=axis)
 
-        cons, subs, trials, chls, ts = np.shape(EEG_data)
 
-        if chl_opt == 1:
+' a function for checking the time-windows of the data '
 
-            # sub_opt=1 & time_opt=0 & chl_opt=1
+def _valid_windows(data, time_win, time_step):
 
-            # initialize the data for calculating the RDM
-            data = np.zeros([subs, chls, cons, ts], dtype=np.float64)
+    # the time-points are the last axis of the data or of the ragged trials
+    n_ts = np.shape(data.trials if isinstance(data, RaggedTrials) else data)[-1]
+    time_wins = list(time_win) if isinstance(time_win, (list, tuple)) else [time_win]
 
-            # assignment
-            for i in range(subs):
-                for j in range(chls):
-                    for k in range(cons):
-                        for l in range(ts):
-                            # average the trials
-                            data[i, j, k, l] = np.average(EEG_data[k, i, :, j, l])
+    if min(time_wins) < 1 or max(time_wins) > n_ts or time_step < 1:
+        print("time_win must be from 1 to n_ts (%d) and time_step must be at least 1" % n_ts)
+        return False
 
-            # initialize the RDMs
-            rdms = np.zeros([subs, chls, cons, cons], dtype=np.float64)
+    return True
 
-            # calculate the values in RDMs
-            for i in range(subs):
-                for j in range(chls):
-                    for k in range(cons):
-                        for l in range(cons):
-                            # calculate the Pearson Coefficient
-                            r = pearsonr(data[i, j, k], data[i, j, l])[0]
-                            # calculate the dissimilarity
-                            rdms[i, j, k, l] = limtozero(1 - abs(r))
 
-            return rdms
+' a function for judging whether the EEG/MEG/fNIRS data are streamed block by block '
 
-        # if chl_opt = 0
+def _streamed(EEG_data, mem_budget):
 
-        # sub_opt=1 & time_opt=0 & chl_opt=0
+    # the ragged trials are averaged by the offsets in one pass
+    if isinstance(EEG_data, RaggedTrials):
+        return False
 
-        # initialize the data for calculating the RDM
-        data = np.zeros([subs, cons, chls, ts], dtype=np.float64)
+    return isinstance(EEG_data, np.memmap) or mem_budget is not None
 
-        # assignment
-        for i in range(subs):
-            for j in range(cons):
-                for k in range(chls):
-                    for l in range(ts):
-                        # average the trials
-                        data[i, j, k, l] = np.average(EEG_data[j, i, :, k, l])
 
-        # flatten the data for different calculating conditions
-        data = np.reshape(data, [subs, cons, chls * ts])
+' a function for calculating the RDM(s) based on trial-averaged data '
 
-        # initialize the RDMs
-        rdms = np.zeros([subs, cons, cons], dtype=np.float64)
+def _avgRDM(avgdata, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5, calRDM=None, condensed=False):
 
-        # calculate the values in RDMs
-        for i in range(subs):
-            for j in range(cons):
-                for k in range(cons):
-                    # calculate the Pearson Coefficient
-                    r = pearsonr(data[i, j], data[i, k])[0]
-                    # calculate the dissimilarity
-                    rdms[i, j, k] = limtozero(1 - abs(r))
+    if calRDM is None:
+        calRDM = patternRDM
 
+    # the overlapping time-windows are calculated by prefix sums along the time
+    if time_opt == 1 and calRDM is patternRDM and time_step < time_win:
+        rdms = _window_rdms(_time_patterns(avgdata, sub_opt, chl_opt), [time_win], time_step)[0]
+        if condensed == True:
+            return CondensedRDMStack(get_upper(rdms))
         return rdms
 
-    # if sub_opt = 0
+    # get the patterns for calculating the RDM(s): [..., n_cons, n_features]
+    patterns = eeg_patterns(avgdata, sub_opt=sub_opt, chl_opt=chl_opt, time_opt=time_opt, time_win=time_win,
+                            time_step=time_step)
+
+    return _patterns_rdms(patterns, calRDM, condensed)
+
+
+' a function for calculating the RDM(s) of patterns, only the values above the diagonal if condensed=True '
+
+def _patterns_rdms(patterns, calRDM, condensed):
+
+    if condensed != True:
+        return calRDM(patterns)
+
+    if calRDM is patternRDM:
+        return patternRDM(patterns, condensed=True)
+
+    return CondensedRDMStack(get_upper(calRDM(patterns)))
+
+
+' a function for calculating the RDM(s) based on EEG/MEG/fNIRS data in the memory '
+
+def _eegRDM_memory(EEG_data, sub_opt, chl_opt, time_opt, time_win, time_step, condensed, store, calRDM):
+
+    # average the trials: [n_cons, n_subs, n_chls, n_ts]
+    avgdata = _average_trials(EEG_data)
+
+    if store is None:
+        return _avgRDM(avgdata, sub_opt, chl_opt, time_opt, time_win, time_step, calRDM, condensed)
+
+    # get the patterns for calculating the RDM(s): [..., n_cons, n_features]
+    patterns = eeg_patterns(avgdata, sub_opt=sub_opt, chl_opt=chl_opt, time_opt=time_opt, time_win=time_win,
+                            time_step=time_step)
+
+    # the names of the leading axes
+    axes = [name for name, opt in zip(["subs", "chls", "ts"], [sub_opt, chl_opt, time_opt]) if opt == 1]
+
+    rdms = RDMStore.create(store, patterns.shape[:-2], patterns.shape[-2], condensed=condensed, axes=axes,
+                           params={"function": "eegRDM", "sub_opt": sub_opt, "chl_opt": chl_opt,
+                                   "time_opt": time_opt, "time_win": time_win, "time_step": time_step})
+
+    # write the RDM(s) chunk by chunk along the first axis
+    if patterns.ndim == 2:
+        rdms[()] = _patterns_rdms(patterns, calRDM, condensed)
+    else:
+        for i in range(patterns.shape[0]):
+            rdms[i] = _patterns_rdms(patterns[i], calRDM, condensed)
+
+    # reopen the written store read-only
+    rdms.flush()
+
+    return RDMStore(store)
+
 
+' a function for getting the patterns of EEG/MEG/fNIRS data for calculating the RDM(s) '
+
+def eeg_patterns(avgdata, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5):
+
+    """
+    Get the patterns of trial-averaged EEG/MEG/fNIRS data for calculating the RDM(s)
+
+    Parameters
+    ----------
+    avgdata : array
+        The trial-averaged EEG/MEG/fNIRS data.
+        The shape of avgdata must be [n_cons, n_subs, n_chls, n_ts].
+    sub_opt, chl_opt, time_opt, time_win, time_step :
+        The same as eegRDM().
+
+    Returns
+    -------
+    patterns : array
+        The patterns with the leading axes of eegRDM()'s output, such as [n_subs, n_chls, n_ts', n_cons, n_features]
+        for sub_opt=1, chl_opt=1 & time_opt=1. The features are the remaining axes among subjects, channels & the
+        time-points (of each time-window).
+    """
+
+    # [..., n_cons, feature axes...] -> [..., n_cons, n_features]
+    patterns, n_lead = _pattern_view(avgdata, sub_opt, chl_opt, time_opt, time_win, time_step)
+    shape = patterns.shape[:n_lead+1]
+
+    return np.reshape(patterns, shape + (-1,))
+
+
+' a function for getting the patterns of EEG/MEG/fNIRS data as a view without flattening the features '
+
+def _pattern_view(avgdata, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5):
+
+    # the time-windows: [n_cons, n_subs, n_chls, n_windows, n_points]
     if time_opt == 1:
+        windows = get_windows(avgdata, time_win=time_win, time_step=time_step)
+    else:
+        windows = avgdata[:, :, :, np.newaxis]
 
-        # the time-points for calculating RDM
-        ts = int((ts-time_win)/time_step)+1
+    # the leading axes & the feature axes
+    opts = [sub_opt, chl_opt, time_opt]
+    lead = [i+1 for i in range(3) if opts[i] == 1]
+    features = [i+1 for i in range(3) if opts[i] != 1] + [4]
 
-        if chl_opt == 1:
+    # [n_cons, n_subs, n_chls, n_windows, n_points] -> [..., n_cons, feature axes...]
+    return np.transpose(windows, lead + [0] + features), len(lead)
 
-            # sub_opt=0 & time_opt=1 & chl_opt=1
-
-            # initialize the data for calculating the RDM
-            data = np.zeros([chls, ts, cons, subs, time_win], dtype=np.float64)
-
-            # assignment
-            for i in range(chls):
-                for j in range(ts):
-                    for k in range(cons):
-                        for l in range(subs):
-                            for m in range(time_win):
-                                # average the trials
-                                data[i, j, k, l, m] = np.average(EEG_data[k, l, :, i, j * time_win + m])
-
-            # flatten the data for different calculating conditions
-            data = np.reshape(data, [chls, ts, cons, subs * time_win])
-
-            # initialize the RDMs
-            rdms = np.zeros([chls, ts, cons, cons], dtype=np.float64)
-
-            # calculate the values in RDMs
-            for i in range(chls):
-                for j in range(ts):
-                    for k in range(cons):
-                        for l in range(cons):
-                            # calculate the Pearson Coefficient
-                            r = pearsonr(data[i, j, k], data[i, j, l])[0]
-                            # calculate the dissimilarity
-                            rdms[i, j, k, l] = limtozero(1 - abs(r))
-
-            return rdms
-
-        # sub_opt=0 & time_opt=1 & chl_opt=0
-
-        # initialize the data for calculating the RDM
-        data = np.zeros([ts, cons, subs, chls, time_win], dtype=np.float64)
-
-        # assignment
-        for i in range(ts):
-            for j in range(cons):
-                for k in range(subs):
-                    for l in range(chls):
-                        for m in range(time_win):
-                            # average the trials
-                            data[i, j, k, l, m] = np.average(EEG_data[j, k, :, l, i * time_win + m])
-
-        # flatten the data for different calculating conditions
-        data = np.reshape(data, [ts, cons, subs * chls * time_win])
-
-        # initialize the RDMs
-        rdms = np.zeros([ts, cons, cons], dtype=np.float64)
-
-        # calculate the values in RDMs
-        for i in range(ts):
-            for j in range(cons):
-                for k in range(cons):
-                    # calculate the Pearson Coefficient
-                    r = pearsonr(data[i, j], data[i, k])[0]
-                    # calculate the dissimilarity
-                    rdms[i, j, k] = limtozero(1 - abs(r))
 
-        return rdms
+' a function for calculating the RDM(s) based on EEG/MEG/fNIRS data lazily batch by batch '
+
+def eegRDM_batches(EEG_data, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5, batch=256):
 
-    # if time_opt = 0
+    """
+    Calculate the Representational Dissimilarity Matrices (RDMs) for EEG/MEG/fNIRS data lazily batch by batch
 
-    # sub_opt=0 & time_opt=0 & chl_opt=1
+    Parameters
+    ----------
+    EEG_data : array or RaggedTrials
+        The EEG/MEG/fNIRS data.
+        The shape of EEGdata must be [n_cons, n_subs, n_trials, n_chls, n_ts].
+    sub_opt, chl_opt, time_opt, time_win, time_step :
+        The same as eegRDM().
+    batch : int. Default is 256.
+        The number of RDMs in each batch.
 
-    # get the number of conditions, subjects, trials, channels & time-points
-    cons, subs, trials, chls, ts = np.shape(EEG_data)
+    Returns
+    -------
+    batches : RDMBatches
+        The lazy batches of the RDMs with the leading axes of eegRDM()'s output, such as
+        [n_subs, n_chls, int((n_ts-time_win)/time_step)+1] for sub_opt=1, chl_opt=1 & time_opt=1.
+        Iterating over it yields (index, rdms): rdms is an array [b, n_cons, n_cons] and index is the tuple of their
+        positions in the leading axes. It can be passed to rdms_corr() directly, e.g.
+        rdms_corr(demo_rdm, eegRDM_batches(EEG_data, 1, 1, 1)), so the whole stack of RDMs is never held.
 
-    if chl_opt == 1:
+    Notes
+    -----
+    Only the trial-averaged data are held. The patterns of each batch are gathered from a strided view of the
+    trial-averaged data when the batch is requested.
+    """
 
-        # initialize the data for calculating the RDM
-        data = np.zeros([chls, cons, subs, ts], dtype=np.float64)
+    if time_opt == 1 and _valid_windows(EEG_data, time_win, time_step) == False:
+        return None
 
-        # assignment
-        for i in range(chls):
-            for j in range(cons):
-                for k in range(subs):
-                    for l in range(ts):
-                        # average the trials
-                        data[i, j, k, l] = np.average(EEG_data[j, k, :, i, l])
+    # average the trials: [n_cons, n_subs, n_chls, n_ts]
+    avgdata = _average_trials(EEG_data)
 
-        # flatten the data for different calculating conditions
-        data = np.reshape(data, [chls, cons, subs * ts])
+    # the view of the patterns: [..., n_cons, feature axes...]
+    view, n_lead = _pattern_view(avgdata, sub_opt, chl_opt, time_opt, time_win, time_step)
+    shape = view.shape[:n_lead]
+    n = int(np.prod(shape))
 
-        # initialize the RDMs
-        rdms = np.zeros([chls, cons, cons], dtype=np.float64)
+    def generate():
 
-        # calculate the values in RDMs
-        for i in range(chls):
-            for j in range(cons):
-                for k in range(cons):
-                    # calculate the Pearson Coefficient
-                    r = pearsonr(data[i, j], data[i, k])[0]
-                    # calculate the dissimilarity
-                    rdms[i, j, k] = limtozero(1 - abs(r))
+        for b0 in range(0, n, batch):
 
-        return rdms
+            # the positions of the RDMs in the batch & their patterns: [b, n_cons, n_features]
+            if n_lead == 0:
+                index = ()
+                patterns = np.reshape(view, [1, view.shape[0], -1])
+            else:
+                index = np.unravel_index(np.arange(b0, min(b0+batch, n)), shape)
+                patterns = np.reshape(view[index], [len(index[0]), view.shape[n_lead], -1])
+
+            yield index, patternRDM(patterns)
+
+    return RDMBatches(shape, view.shape[n_lead], generate)
+
+
+' a function for calculating the RDMs of the neighbourhoods of the channels (sensor-space searchlight) '
+
+def eegRDM_searchlight(EEG_data, positions=None, adjacency=None, radius=None, sub_opt=0, time_opt=0, time_win=5,
+                       time_step=5, batch=64):
+
+    """
+    Calculate the Representational Dissimilarity Matrices (RDMs) for the neighbourhood of each channel of EEG/MEG/fNIRS
+    data (sensor-space searchlight)
+
+    Parameters
+    ----------
+    EEG_data : array or RaggedTrials
+        The EEG/MEG/fNIRS data.
+        The shape of EEGdata must be [n_cons, n_subs, n_trials, n_chls, n_ts].
+    positions : array or None. Default is None.
+        The positions of the channels. The shape must be [n_chls, n_dims], such as [n_chls, 3].
+        The neighbourhood of a channel includes the channels within the radius.
+    adjacency : array or list or None. Default is None.
+        The neighbours of the channels, a boolean matrix [n_chls, n_chls] or a list of n_chls lists of channel indices.
+        The neighbourhood of a channel includes itself & its neighbours. If adjacency is given, positions is ignored.
+    radius : float or None. Default is None.
+        The radius of the neighbourhoods, in the unit of the positions. It must be given with positions.
+    sub_opt, time_opt, time_win, time_step :
+        The same as eegRDM().
+    batch : int. Default is 64.
+        The number of neighbourhoods calculated together.
+
+    Returns
+    -------
+    RDM(s) : array
+        The EEG/MEG/fNIRS RDM(s) of the neighbourhoods, with the shapes of eegRDM() with chl_opt=1.
+        If sub_opt=0 & time_opt=0, return n_chls RDMs.
+            The shape is [n_chls, n_cons, n_cons].
+        If sub_opt=0 & time_opt=1, return n_chls*(int((n_ts-time_win)/time_step)+1) RDMs.
+            The shape is [n_chls, int((n_ts-time_win)/time_step)+1, n_cons, n_cons].
+        If sub_opt=1 & time_opt=0, return n_subs*n_chls RDMs.
+            The shape is [n_subs, n_chls, n_cons, n_cons].
+        If sub_opt=1 & time_opt=1, return n_subs*n_chls*(int((n_ts-time_win)/time_step)+1) RDMs.
+            The shape is [n_subs, n_chls, int((n_ts-time_win)/time_step)+1, n_cons, n_cons].
+
+    Notes
+    -----
+    The neighbourhoods are stored as a padded array of channel indices [n_chls, max_n_neighbours] with a mask, so the
+    patterns of a batch of neighbourhoods are gathered by one indexing & their RDMs are calculated by one batched matrix
+    product. The padded entries are zeroed after centering each pattern by the mean of its real entries, so they do not
+    change the Pearson Coefficients.
+    """
+
+    if time_opt == 1 and _valid_windows(EEG_data, time_win, time_step) == False:
+        return None
+
+    # average the trials: [n_cons, n_subs, n_chls, n_ts]
+    avgdata = _average_trials(EEG_data)
+    n_cons, n_subs, n_chls, n_ts = avgdata.shape
+
+    neighbours = _channel_neighbours(n_chls, positions, adjacency, radius)
+
+    if neighbours is None:
+        return None
+
+    # the padded indices & the mask of the neighbourhoods: [n_chls, max_n_neighbours]
+    index, mask = _neighbourhood_index(neighbours)
+
+    # the leading axes & the feature axes of [n_cons, n_subs, n_chls, n_neighbours, n_windows, n_points]
+    lead = [1]*(sub_opt == 1) + [2] + [4]*(time_opt == 1)
+    features = [1]*(sub_opt != 1) + [3] + [4]*(time_opt != 1) + [5]
+
+    rdms = []
+
+    for c0 in range(0, n_chls, batch):
+
+        # gather the neighbourhoods of the batch: [n_cons, n_subs, b, max_n_neighbours, n_ts]
+        data = avgdata[:, :, index[c0:c0+batch]]
+        m = np.broadcast_to(mask[c0:c0+batch, :, np.newaxis], data.shape[2:]).astype(np.float64)
+
+        # the time-windows: [..., n_windows, n_points]
+        if time_opt == 1:
+            data = get_windows(data, time_win=time_win, time_step=time_step)
+            m = get_windows(m, time_win=time_win, time_step=time_step)
+        else:
+            data = data[..., np.newaxis, :]
+            m = m[..., np.newaxis, :]
+
+        # the patterns & the masks: [..., b, ..., n_cons, n_features]
+        patterns = np.transpose(data, lead + [0] + features)
+        shape = patterns.shape[:len(lead)+1]
+        patterns = np.reshape(patterns, shape + (-1,))
+        m = np.transpose(np.broadcast_to(m, data.shape), lead + [0] + features)
+        m = np.reshape(m, shape + (-1,))
+
+        # center each pattern by the mean of its real entries & zero the padded entries
+        means = np.sum(patterns*m, axis=-1, keepdims=True) / np.sum(m, axis=-1, keepdims=True)
+        z = normalize_vectors((patterns - means)*m, center=False)
+
+        rdms.append(patternRDM(z, normalized=True))
+
+    # concatenate the batches along the channel axis
+    return np.concatenate(rdms, axis=int(sub_opt == 1))
+
+
+' a function for getting the neighbourhood of each channel '
+
+def _channel_neighbours(n_chls, positions=None, adjacency=None, radius=None):
+
+    if adjacency is not None:
+        if isinstance(adjacency, np.ndarray) and adjacency.shape == (n_chls, n_chls):
+            adjacency = [np.flatnonzero(row) for row in adjacency]
+        if len(adjacency) != n_chls:
+            print("adjacency must have the neighbours of each of the %d channels" % n_chls)
+            return None
+    elif positions is not None:
+        if radius is None:
+            print("radius must be given with positions")
+            return None
+        positions = np.asarray(positions, dtype=np.float64)
+        if positions.shape[0] != n_chls:
+            print("positions must have the position of each of the %d channels" % n_chls)
+            return None
+        distances = np.linalg.norm(positions[:, np.newaxis] - positions[np.newaxis], axis=-1)
+        adjacency = [np.flatnonzero(row) for row in distances <= radius]
+    else:
+        print("positions or adjacency must be given")
+        return None
+
+    # each neighbourhood includes its center channel
+    return [np.union1d([i], np.asarray(adjacency[i], dtype=np.int64)) for i in range(n_chls)]
+
+
+' a function for getting the padded array of the indices of the neighbourhoods '
+
+def _neighbourhood_index(neighbours):
+
+    counts = np.array([len(n) for n in neighbours])
+
+    # pad each neighbourhood with its center channel, masked out
+    index = np.repeat(np.arange(len(neighbours))[:, np.newaxis], np.max(counts), axis=1)
+    mask = np.arange(np.max(counts))[np.newaxis] < counts[:, np.newaxis]
+    index[mask] = np.concatenate(neighbours)
+
+    return index, mask
+
+
+' a function for calculating the RDM(s) based on patterns '
+
+def patternRDM(patterns, condensed=False, normalized=False):
+
+    """
+    Calculate the Representational Dissimilarity Matrix(Matrices) - RDM(s) based on patterns
+
+    Parameters
+    ----------
+    patterns : array
+        The patterns of each condition.
+        The shape of patterns must be [..., n_cons, n_features].
+    condensed : bool True or False. Default is False.
+        Return the RDM(s) as a CondensedRDMStack or not.
+    normalized : bool True or False. Default is False.
+        The patterns have already been centered & normalized by normalize_vectors() or not.
+
+    Returns
+    -------
+    RDM(s) : array or CondensedRDMStack
+        The RDM(s) based on 1 - |Pearson Coefficient|.
+        The shape is [..., n_cons, n_cons]. If condensed=True, return a CondensedRDMStack with the shape [...].
+    """
+
+    # normalize the patterns & calculate the Pearson Coefficients by one matrix product
+    if normalized == True:
+        z = patterns
+    else:
+        z = normalize_vectors(patterns)
+
+    # only calculate the dissimilarities above the diagonal, so the full RDM(s) are never built
+    if condensed == True:
+        return CondensedRDMStack(_upper_rdms(z))
+
+    # calculate the dissimilarities
+    rdms = 1 - np.abs(np.matmul(z, np.swapaxes(z, -1, -2)))
+    rdms[rdms < 1e-15] = 0
+
+    return rdms
+
+
+' a function for calculating the dissimilarities above the diagonal of normalized patterns block of rows by block '
+
+def _upper_rdms(z):
+
+    cons = z.shape[-2]
+    values = np.zeros(z.shape[:-2] + (int(cons*(cons-1)/2),), dtype=np.float64)
+
+    # the number of rows in each block: the products of a block take about an eighth of the values
+    block = max(1, cons // 16)
+
+    start = 0
+    for i0 in range(0, cons-1, block):
+
+        i1 = min(i0+block, cons-1)
+
+        # the products of the rows in the block with the later rows: [..., b, n_cons-i0-1]
+        products = np.matmul(z[..., i0:i1, :], np.swapaxes(z[..., i0+1:, :], -1, -2))
+
+        # the values above the diagonal in row-major order
+        mask = np.arange(i0+1, cons)[np.newaxis, :] > np.arange(i0, i1)[:, np.newaxis]
+        n = int(np.sum(mask))
+        values[..., start:start+n] = products[..., mask]
+        start += n
 
-    # if chl_opt = 0
+    # calculate the dissimilarities in place
+    np.abs(values, out=values)
+    np.subtract(1, values, out=values)
+    values[values < 1e-15] = 0
 
-    # sub_opt=0 & time_opt=0 & chl_opt=0
+    return values
+
+
+' a function for accumulating the statistics of the Pearson Coefficients between patterns chunk by chunk '
+
+def _gram_update(stats, x):
+
+    # x: a chunk of features of the patterns, [..., n_cons, n_chunk]
+    x = np.asarray(x, dtype=np.float64)
+
+    if stats is None:
+        # shift each pattern by the mean of its first chunk for numerical stability (the correlations are not changed)
+        shift = np.mean(x, axis=-1, keepdims=True)
+        zeros = np.zeros(x.shape[:-1], dtype=np.float64)
+        stats = {"shift": shift, "s": zeros, "ss": zeros.copy(),
+                 "g": np.zeros(x.shape[:-1] + (x.shape[-2],), dtype=np.float64), "n": 0}
+
+    x = x - stats["shift"]
+
+    # the sums, the sums of squares & the cross-products
+    stats["s"] += np.sum(x, axis=-1)
+    stats["ss"] += np.sum(x*x, axis=-1)
+    stats["g"] += np.matmul(x, np.swapaxes(x, -1, -2))
+    stats["n"] += x.shape[-1]
+
+    return stats
+
+
+' a function for calculating the RDM(s) from the accumulated statistics '
+
+def _gram_rdms(stats):
+
+    s, n = stats["s"], stats["n"]
+
+    # the covariances & the variances
+    cov = stats["g"] - s[..., :, np.newaxis]*s[..., np.newaxis, :]/n
+    var = np.maximum(stats["ss"] - s*s/n, 0)
+
+    # calculate the dissimilarities
+    rdms = 1 - np.abs(cov / np.sqrt(var[..., :, np.newaxis]*var[..., np.newaxis, :]))
+    rdms[rdms < 1e-15] = 0
+
+    return rdms
+
+
+' a function for getting the patterns of each time-point of trial-averaged EEG/MEG/fNIRS data '
+
+def _time_patterns(avgdata, sub_opt=0, chl_opt=0):
+
+    # the leading axes & the feature axes
+    lead = [i+1 for i in range(2) if [sub_opt, chl_opt][i] == 1]
+    features = [i+1 for i in range(2) if [sub_opt, chl_opt][i] != 1]
+
+    # [n_cons, n_subs, n_chls, n_ts] -> [..., n_cons, n_features, n_ts]
+    patterns = np.transpose(avgdata, lead + [0] + features + [3])
+    shape = patterns.shape[:len(lead)+1]
+
+    return np.reshape(patterns, shape + (-1, patterns.shape[-1]))
+
+
+' a function for calculating the RDMs of sliding time-windows by prefix sums '
+
+def _window_rdms(patterns, time_wins, time_step, mem_budget=2**28):
+
+    """
+    Calculate the RDMs of the sliding time-windows of one or several widths from prefix sums along the time
+
+    Parameters
+    ----------
+    patterns : array [..., n_cons, n_features, n_ts]
+        The patterns of each time-point.
+    time_wins : list of int
+        The widths of the time-windows.
+    time_step : int
+        The time step size of the time-windows.
+    mem_budget : int. Default is 2**28 (256 MB).
+        The approximate memory budget in bytes for the prefix sums of each block of leading axes.
+
+    Returns
+    -------
+    rdms : list of array
+        The RDMs of each width, [..., int((n_ts-time_win)/time_step)+1, n_cons, n_cons].
+
+    Notes
+    -----
+    The sums, the sums of squares & the cross-products of the patterns of each time-point are calculated once and
+    accumulated along the time. The statistics of any window are then the differences of two prefix sums, so each
+    window costs O(n_cons^2) whatever its width, and several widths are calculated in one pass.
+    """
+
+    patterns = np.asarray(patterns, dtype=np.float64)
+    lead = patterns.shape[:-3]
+    cons, nf, ts = patterns.shape[-3:]
+
+    # flatten the leading axes: [n, n_cons, n_features, n_ts]
+    patterns = np.reshape(patterns, (-1, cons, nf, ts))
+    n = patterns.shape[0]
+
+    # the public functions report invalid time-windows before, this guards the prefix sums
+    if min(time_wins) < 1 or max(time_wins) > ts or time_step < 1:
+        raise ValueError("time_win must be from 1 to n_ts (%d) and time_step must be at least 1" % ts)
+
+    # the number of time-windows of each width
+    nws = [int((ts-w)/time_step)+1 for w in time_wins]
+    rdms = [np.zeros([n, nw, cons, cons], dtype=np.float64) for nw in nws]
+
+    # the number of leading items in each block
+    block = max(1, int(mem_budget / (8 * 2 * (ts+1) * (cons*cons + 3*cons + nf*cons))))
+
+    for b0 in range(0, n, block):
+
+        x = patterns[b0:b0+block]
+
+        # record the NaN values and set them to 0
+        nans = np.isnan(x).any(axis=2)
+        x = np.where(np.isnan(x), 0, x)
+
+        # shift each pattern by its mean for numerical stability (the correlations are not changed)
+        x = x - np.mean(x, axis=(-2, -1), keepdims=True)
+
+        # the statistics of each time-point: [b, n_ts, n_cons, n_cons] & [b, n_ts, n_cons]
+        xt = np.transpose(x, (0, 3, 1, 2))
+        stats = [np.matmul(xt, np.swapaxes(xt, -1, -2)), np.sum(xt, axis=-1), np.sum(xt*xt, axis=-1),
+                 np.transpose(nans, (0, 2, 1)).astype(np.float64)]
+
+        # the prefix sums along the time, starting with 0
+        prefix = []
+        for stat in stats:
+            p = np.zeros((stat.shape[0], ts+1) + stat.shape[2:], dtype=np.float64)
+            p[:, 1:] = np.cumsum(stat, axis=1)
+            prefix.append(p)
+
+        for k, w in enumerate(time_wins):
+
+            # the statistics of the windows by the differences of the prefix sums
+            starts = np.arange(nws[k]) * time_step
+            g, s, ss, nan_counts = [p[:, starts+w] - p[:, starts] for p in prefix]
+
+            rdm = _gram_rdms({"g": g, "s": s, "ss": ss, "n": nf*w})
+
+            # the conditions with NaN in the window
+            invalid = nan_counts > 0.5
+            rdm[invalid] = np.nan
+            rdm[np.repeat(invalid[..., np.newaxis, :], cons, axis=-2)] = np.nan
+
+            rdms[k][b0:b0+block] = rdm
+
+    return [np.reshape(rdm, lead + rdm.shape[1:]) for rdm in rdms]
+
+
+' a function for accumulating the random projections of patterns chunk by chunk '
+
+def _projection_update(stats, x, n_components, seed, n_features=None, chunk=2**14):
+
+    # x: a chunk of features of the patterns, [..., n_cons, n_chunk]
+    if stats is None:
+        # shift each pattern by the mean of its first chunk for numerical stability (the correlations are not changed)
+        shift = np.mean(np.asarray(x[..., :chunk], dtype=np.float64), axis=-1, keepdims=True)
+        # the very sparse projection: about sqrt(n_features) nonzero entries per component
+        if n_features is None:
+            n_features = x.shape[-1]
+        density = min(1/3, 1/math.sqrt(n_features))
+        stats = {"shift": shift, "y": np.zeros(x.shape[:-1] + (n_components,), dtype=np.float64),
+                 "s": np.zeros(x.shape[:-1], dtype=np.float64), "r1": np.zeros([n_components], dtype=np.float64),
+                 "n": 0, "block": 0, "density": density}
+
+    for f0 in range(0, x.shape[-1], chunk):
+
+        xc = np.asarray(x[..., f0:f0+chunk], dtype=np.float64) - stats["shift"]
+
+        # the rows of the projection matrix for this chunk
+        R = sparse_projection(xc.shape[-1], n_components, seed=seed, block=stats["block"], density=stats["density"])
+        stats["block"] += 1
+
+        # the projections by a sparse product, the sums of the patterns & the sums of the rows of the projection matrix
+        flat = np.reshape(xc, [-1, xc.shape[-1]])
+        stats["y"] += np.reshape(R.T.dot(flat.T).T, stats["y"].shape)
+        stats["s"] += np.sum(xc, axis=-1)
+        stats["r1"] += np.asarray(R.sum(axis=0)).ravel()
+        stats["n"] += xc.shape[-1]
+
+    return stats
+
+
+' a function for calculating the approximate RDM(s) from the accumulated random projections '
+
+def _projection_rdms(stats):
+
+    # the projections of the centered patterns: R(x - mean) = Rx - mean*R1
+    y = stats["y"] - (stats["s"] / stats["n"])[..., np.newaxis]*stats["r1"]
+
+    # calculate the dissimilarities
+    z = normalize_vectors(y, center=False)
+    rdms = 1 - np.abs(np.matmul(z, np.swapaxes(z, -1, -2)))
+    rdms[rdms < 1e-15] = 0
+
+    return rdms
+
+
+' a function for getting the function for calculating the RDM(s) of patterns '
+
+def _rdm_function(approx, n_components, seed):
+
+    if approx == True:
+        return lambda patterns: _projection_rdms(_projection_update(None, patterns, n_components, seed))
+
+    return patternRDM
+
+
+' a function for getting the number of features of each pattern of EEG/MEG/fNIRS data '
+
+def _n_features(EEG_data, sub_opt=0, chl_opt=0, time_opt=0, time_win=5):
+
+    # [n_cons, n_subs, n_trials, n_chls, n_ts], or the trials [n_total_trials, n_chls, n_ts] of a RaggedTrials
+    if isinstance(EEG_data, RaggedTrials):
+        subs = EEG_data.n_subs
+        chls, ts = np.shape(EEG_data.trials)[1:]
+    else:
+        subs, chls, ts = [np.shape(EEG_data)[i] for i in [1, 3, 4]]
+
+    n = time_win if time_opt == 1 else ts
+    if sub_opt != 1:
+        n *= subs
+    if chl_opt != 1:
+        n *= chls
+
+    return n
+
+
+' a function for calculating the RDM(s) based on EEG/MEG/fNIRS data streamed block by block '
+
+def _eegRDM_stream(EEG_data, sub_opt, chl_opt, time_opt, time_win, time_step, condensed, store, mem_budget, calRDM,
+                   approx=False, n_components=1024, seed=0):
 
     # get the number of conditions, subjects, trials, channels & time-points
     cons, subs, trials, chls, ts = np.shape(EEG_data)
+    itemsize = np.dtype(EEG_data.dtype).itemsize
+
+    # the number of channels in each block: the averaged block (& its patterns) take half of the budget
+    chl_block = int(max(1, min(chls, mem_budget / 2 / (8 * 3 * cons*subs*ts))))
+
+    # the number of time-points in each block
+    # with chl_opt=0 & time_opt=0, the time-points are also features and can be chunked, so the memory does not depend
+    # on the number of features
+    if chl_opt == 0 and time_opt == 0:
+        ts_block = int(max(1, min(ts, mem_budget / 2 / (8 * 3 * cons*subs*chl_block))))
+    else:
+        ts_block = ts
+
+    # the number of trials read at once: the raw block (& its float64 copy) take the other half
+    trial_block = int(max(1, min(trials, mem_budget / 2 / ((itemsize + 8) * cons*subs*chl_block*ts_block))))
+
+    # the leading axes of the outputs
+    nw = int((ts-time_win)/time_step)+1 if time_opt == 1 else 1
+    lead = [n for n, opt in zip([subs, chls, nw], [sub_opt, chl_opt, time_opt]) if opt == 1]
+
+    # initialize the RDM(s)
+    if store is not None:
+        axes = [name for name, opt in zip(["subs", "chls", "ts"], [sub_opt, chl_opt, time_opt]) if opt == 1]
+        rdms = RDMStore.create(store, lead, cons, condensed=condensed, axes=axes,
+                               params={"function": "eegRDM", "sub_opt": sub_opt, "chl_opt": chl_opt,
+                                       "time_opt": time_opt, "time_win": time_win, "time_step": time_step})
+    elif chl_opt == 1 and condensed == True:
+        rdms = np.zeros(lead + [int(cons*(cons-1)/2)], dtype=np.float64)
+    elif chl_opt == 1:
+        rdms = np.zeros(lead + [cons, cons], dtype=np.float64)
+
+    stats = None
+
+    # the blocks of channels & time-points
+    blocks = [(c0, min(c0+chl_block, chls), p0, min(p0+ts_block, ts)) for c0 in range(0, chls, chl_block)
+              for p0 in range(0, ts, ts_block)]
+
+    for c0, c1, p0, p1 in blocks:
+
+        # read the block once & average the trials: [n_cons, n_subs, chl_block, ts_block]
+        avgdata = np.zeros([cons, subs, c1-c0, p1-p0], dtype=np.float64)
+        for t0 in range(0, trials, trial_block):
+            avgdata += np.sum(np.asarray(EEG_data[:, :, t0:t0+trial_block, c0:c1, p0:p1], dtype=np.float64), axis=2)
+        avgdata /= trials
+
+        patterns = eeg_patterns(avgdata, sub_opt=sub_opt, chl_opt=chl_opt, time_opt=time_opt, time_win=time_win,
+                                time_step=time_step)
 
-    # initialize the data for calculating the RDM
-    data = np.zeros([cons, subs, chls, ts], dtype=np.float64)
+        if chl_opt == 1:
 
-    # assignment
-    for i in range(cons):
-        for j in range(subs):
-            for k in range(chls):
-                for l in range(ts):
-                    # average the trials
-                    data[i, j, k, l] = np.average(EEG_data[i, j, :, k, l])
+            # the RDMs of the channels in the block are independent of the other blocks
+            block_rdms = _patterns_rdms(patterns, calRDM, condensed)
+            if condensed == True and store is None:
+                block_rdms = get_upper(block_rdms)
 
-    # flatten the data for different calculating condition
-    data = np.reshape(data, [cons, subs * chls * ts])
+            if sub_opt == 1:
+                rdms[:, c0:c1] = block_rdms
+            else:
+                rdms[c0:c1] = block_rdms
 
-    # initialize the RDM
-    rdm = np.zeros([cons, cons], dtype=np.float64)
+        elif approx == True:
 
-    # calculate the values in RDM
-    for i in range(cons):
-        for j in range(cons):
-            # calculate the Pearson Coefficient
-            r = pearsonr(data[i], data[j])[0]
-            # calculate the dissimilarity
-            rdm[i, j] = limtozero(1 - np.abs(r))
+            # the channels (& the time-points) are features, accumulate the random projections
+            stats = _projection_update(stats, patterns, n_components, seed,
+                                       n_features=_n_features(EEG_data, sub_opt, chl_opt, time_opt, time_win))
 
-    return rdm
+        else:
+
+            # the channels (& the time-points) are features, accumulate the statistics
+            stats = _gram_update(stats, patterns)
+
+    if chl_opt == 0:
+        result = _projection_rdms(stats) if approx == True else _gram_rdms(stats)
+        if store is None:
+            rdms = result
+        else:
+            rdms[()] = result
+
+    # reopen the written store read-only
+    if store is not None:
+        rdms.flush()
+        return RDMStore(store)
+
+    if condensed == True and chl_opt == 1:
+        return CondensedRDMStack(rdms)
+    elif condensed == True:
+        return CondensedRDMStack(get_upper(rdms))
+
+    return rdms
+
+
+' a function for calculating the trial-level RDM(s) based on EEG/MEG/fNIRS data '
+
+def eegRDM_trial(trial_data, time_opt=0, time_win=5, time_step=5, tile=512, dtype=np.float32, model_rdm=None,
+                 method="pearson"):
+
+    """
+    Calculate the trial-by-trial Representational Dissimilarity Matrix(Matrices) - RDM(s) for EEG/MEG/fNIRS data
+
+    Parameters
+    ----------
+    trial_data : array
+        The EEG/MEG/fNIRS data of single trials.
+        The shape of trial_data must be [n_trials, n_chls, n_ts].
+        n_trials, n_chls & n_ts represent the number of trials (of all conditions), the number of channels & the number
+        of time-points, respectively.
+    time_opt : int 0 or 1. Default is 0.
+        Calculate the RDM for each time-point or not
+        If time_opt=0, calculate the RDM based on whole time-points' data.
+        If time_opt=1, calculate the RDMs based on each time-points respectively.
+    time_win : int. Default is 5.
+        Set a time-window for calculating the RDM for different time-points.
+        Only when time_opt=1, time_win works.
+    time_step : int. Default is 5.
+        The time step size for each time of calculating.
+        Only when time_opt=1, time_step works.
+    tile : int. Default is 512.
+        The number of trials in each tile. The RDM is calculated tile by tile to stay in the cache & bound the memory.
+    dtype : data-type. Default is np.float32.
+        The data-type of the returned values above the diagonal.
+    model_rdm : array or None. Default is None.
+        A trial-level model RDM. The shape must be [n_trials, n_trials] or [n_trials*(n_trials-1)/2].
+        If model_rdm is not None, each tile is streamed into the Pearson Correlation with the model RDM and the RDM
+        itself is not kept.
+    method : string 'pearson'. Default is 'pearson'.
+        The method to calculate the correlations with the model RDM. Only the Pearson Correlation can be streamed tile
+        by tile, as the Spearman Correlation needs the ranks of all values. For the Spearman Correlation, calculate
+        the RDM(s) with model_rdm=None & use rdms_corr().
+
+    Returns
+    -------
+    RDM(s) : array
+        If model_rdm=None, the values above the diagonal of the trial-level RDM(s) in row-major order.
+            If time_opt=0, the shape is [n_trials*(n_trials-1)/2].
+            If time_opt=1, the shape is [int((n_ts-time_win)/time_step)+1, n_trials*(n_trials-1)/2].
+        If model_rdm is not None, the Pearson Correlations between the RDM(s) and the model RDM.
+            If time_opt=0, the shape is [2]. If time_opt=1, the shape is [int((n_ts-time_win)/time_step)+1, 2].
+            2 represents a r-value and a p-value.
+    """
+
+    if model_rdm is not None and method != "pearson":
+        print("the method for the streamed correlations with model_rdm must be 'pearson'")
+        return None
+
+    if time_opt == 1 and _valid_windows(trial_data, time_win, time_step) == False:
+        return None
+
+    # get the number of trials
+    trials = np.shape(trial_data)[0]
+
+    # the number of values above the diagonal
+    n = int(trials*(trials-1)/2)
+
+    # the time-windows as a view: [n_trials, n_chls, n_windows, time_win] or [n_trials, n_chls, 1, n_ts]
+    if time_opt == 1:
+        windows = get_windows(trial_data, time_win=time_win, time_step=time_step)
+    else:
+        windows = np.asarray(trial_data)[:, :, np.newaxis]
+    nw = windows.shape[2]
+
+    # the values of the model RDM above the diagonal
+    if model_rdm is not None:
+        model_rdm = np.asarray(model_rdm, dtype=np.float64)
+        if model_rdm.ndim == 2:
+            i, j = np.triu_indices(trials, k=1)
+            model_rdm = model_rdm[i, j]
+
+    # the starting position of each row in the values above the diagonal
+    row_starts = np.arange(trials)*trials - np.arange(trials)*(np.arange(trials)+1)//2 - np.arange(trials) - 1
+
+    # initialize the results
+    if model_rdm is None:
+        results = np.zeros([nw, n], dtype=dtype)
+    else:
+        results = np.zeros([nw, 2], dtype=np.float64)
+
+    for t in range(nw):
+
+        # normalize the feature vectors of this time-window only: [n_trials, n_features]
+        z = normalize_vectors(np.reshape(windows[:, :, t], [trials, -1]))
+
+        # the running sums for the correlation with the model RDM
+        sums = np.zeros([5], dtype=np.float64)
+
+        # calculate the RDM tile by tile
+        for i0 in range(0, trials, tile):
+            for j0 in range(i0, trials, tile):
+
+                rows = np.arange(i0, min(i0+tile, trials))
+                cols = np.arange(j0, min(j0+tile, trials))
+
+                # calculate the dissimilarities of the tile
+                block = 1 - np.abs(np.dot(z[rows], z[cols].T))
+                block[block < 1e-15] = 0
+
+                # only the values above the diagonal
+                mask = cols[None, :] > rows[:, None]
+                index = (row_starts[rows][:, None] + cols[None, :])[mask]
+                values = block[mask]
+
+                if model_rdm is None:
+                    results[t, index] = values
+                else:
+                    model_values = model_rdm[index]
+                    sums += [np.sum(values), np.sum(model_values), np.sum(values*values),
+                             np.sum(model_values*model_values), np.sum(values*model_values)]
+
+        if model_rdm is not None:
+
+            # calculate the Pearson Correlation from the running sums
+            cov = sums[4] - sums[0]*sums[1]/n
+            var1 = sums[2] - sums[0]*sums[0]/n
+            var2 = sums[3] - sums[1]*sums[1]/n
+            results[t, 0] = cov / np.sqrt(var1*var2)
+            results[t, 1] = corr_pvalue(results[t, 0], n)
+
+    if time_opt == 1:
+        return results
+
+    return results[0]
 
 
 ' a function for calculating the RDM(s) based on ECoG/sEEG/electrophysiological data '
@@ -462,23 +1173,31 @@ def ecogRDM(ele_data, opt="all", time_win=5, time_step=5):
 
     Parameters
     ----------
-    ele_data : array
+    ele_data : array or RaggedTrials
         The ECoG/sEEG/electrophysiology data.
         The shape of EEGdata must be [n_cons, n_trials, n_chls, n_ts].
         n_cons, n_trials, n_chls & n_ts represent the number of conidtions, the number of trials,
         the number of channels & the number of time-points, respectively.
-    opt : string 'channel', 'time' or 'all'. Default is 'all'.
-        Calculate the RDM for each channel or for each time-point or for the whole data.
+        With different numbers of trials, ele_data can be a RaggedTrials of the trials [n_total_trials, n_chls, n_ts]
+        with one group for each condition. The trials are averaged by the offsets without padding.
+    opt : string 'channel', 'time', 'channel_time' or 'all'. Default is 'all'.
+        Calculate the RDM for each channel or for each time-point or for each channel & time-point or for the whole
+        data.
         If opt='channel', return n_chls RDMs based on each channel's data.
-        If opt='time', return int(ts/time_win) RDMs based on each time-point's data respectively.
-        If opt='allin', return only one RDM based on all data.
-    time_win : int. Default is 5.
+        If opt='time', return int((n_ts-time_win)/time_step)+1 RDMs based on each time-window's data respectively.
+        If opt='channel_time', return n_chls*(int((n_ts-time_win)/time_step)+1) RDMs based on each channel's data of
+        each time-window.
+        If opt='all' (or 'allin'), return only one RDM based on all data.
+    time_win : int or list of int. Default is 5.
         Set a time-window for calculating the RDM for different time-points or not.
-        Only when opt='time', time_win works.
+        Only when opt='time' or opt='channel_time', time_win works.
         If time_win=5, that means each calculation process based on 5 time-points.
+        If time_win is a list of int, return a list of the RDMs for each width of time-windows. The windows of all
+        widths are calculated from one pass of prefix sums along the time, so each window costs the same whatever its
+        width is.
     time_step : int. Default is 5.
         The time step size for each time of calculating.
-        Only when opt='time', time_step works.
+        Only when opt='time' or opt='channel_time', time_step works.
 
     Returns
     -------
@@ -488,78 +1207,43 @@ def ecogRDM(ele_data, opt="all", time_win=5, time_step=5):
             The shape is [n_chls, n_cons, n_cons].
         If opt='time', return int((n_ts-time_win)/time_step)+1 RDM.
             The shape is [int((n_ts-time_win)/time_step)+1, n_cons, n_cons].
+        If opt='channel_time', return n_chls*(int((n_ts-time_win)/time_step)+1) RDM.
+            The shape is [n_chls, int((n_ts-time_win)/time_step)+1, n_cons, n_cons].
         If opt='all', return one RDM.
             The shape is [n_cons, n_cons].
     """
 
-    # get the number of conditins, trials, channels and time points
-    cons, trials, chls, ts = np.shape(ele_data)
-
-    # calculate for each channel
-    if opt == "channel":
-
-        # initialize the data for calculating the RDM
-        data = np.zeros([chls, cons, ts], dtype=np.float64)
-
-        # assignment
-        for i in range(chls):
-            for j in range(cons):
-                for k in range(ts):
-                    # average the trials
-                    data[i, j, k] = np.average(ele_data[j, :, i, k])
-
-        # initialize the RDMs
-        rdms = np.zeros([chls, cons, cons], dtype=np.float64)
-
-        # calculate the values in RDMs
-        for i in range(chls):
-            for j in range(cons):
-                for k in range(cons):
-                    # calculate the Pearson Coefficient
-                    r = pearsonr(data[i, j], data[i, k])[0]
-                    # calculate the dissimilarity
-                    rdms[i, j, k] = limtozero(1 - abs(r))
+    # the channel & time options of each opt
+    opts = {"channel": (1, 0), "time": (0, 1), "channel_time": (1, 1), "all": (0, 0), "allin": (0, 0)}
 
-        return rdms
-
-    # calculate for each time-point
-    elif opt == "time":
-
-        # the time-points for calculating RDM
-        ts = int((ts-time_win)/time_step)+1
+    if opt not in opts:
+        print("opt must be 'channel', 'time', 'channel_time' or 'all'")
+        return None
 
-        # initialize the data for calculating the RDM
-        data = np.zeros([ts, cons, chls, ts], dtype=np.float64)
+    chl_opt, time_opt = opts[opt]
 
-        # assignment
-        for i in range(ts):
-            for j in range(cons):
-                for k in range(chls):
-                    for l in range(ts):
-                        # average the trials
-                        data[i, j, k, l] = np.average(ele_data[j, :, k, i*time_win+l])
+    if isinstance(ele_data, RaggedTrials) and ele_data.n_subs != 1:
+        print("the ragged trials must have one group for each condition")
+        return None
 
-        # flatten the data for different calculating conditions
-        data = np.reshape(data, [ts, cons, chls*ts])
+    if time_opt == 1 and _valid_windows(ele_data, time_win, time_step) == False:
+        return None
 
-        # initialize the RDMs
-        rdms = np.zeros([ts, cons, cons], dtype=np.float64)
+    # average the trials as the data of one subject: [n_cons, 1, n_chls, n_ts]
+    avgdata = _average_trials(ele_data, axis=1)[:, np.newaxis]
 
-        # calculate the values in RDMs
-        for i in range(ts):
-            for j in range(cons):
-                for k in range(cons):
-                    # calculate the Pearson Coefficient
-                    r = pearsonr(np.sort(data[i, j]), np.sort(data[i, k]))[0]
-                    # calculate the dissimilarity
-                    rdms[i, j, k] = limtozero(1 - abs(r))
+    # several widths of time-windows from one pass of prefix sums along the time
+    if time_opt == 1 and isinstance(time_win, (list, tuple)):
+        return _window_rdms(_time_patterns(avgdata, 0, chl_opt), list(time_win), time_step)
 
-        return rdms
+    # calculate the RDM(s) of all channels & time-windows by one batch
+    return _avgRDM(avgdata, sub_opt=0, chl_opt=chl_opt, time_opt=time_opt, time_win=time_win, time_step=time_step)
 
 
 ' a function for calculating the RDM based on fMRI data (searchlight) '
 
-def fmriRDM(fmri_data, ksize=[3, 3, 3], strides=[1, 1, 1]):
+@cached
+def fmriRDM(fmri_data, ksize=[3, 3, 3], strides=[1, 1, 1], condensed=False, store=None):
 
     """
     Calculate the Representational Dissimilarity Matrices (RDMs) for fMRI data (Searchlight)
@@ -575,79 +1259,70 @@ def fmriRDM(fmri_data, ksize=[3, 3, 3], strides=[1, 1, 1]):
         The size of the fMRI-img. nx, ny, nz represent the number of voxels along the x, y, z axis.
     strides : array or list [sx, sy, sz]. Default is [1, 1, 1].
         The strides for calculating along the x, y, z axis.
+    condensed : bool True or False. Default is False.
+        Return the RDMs as a CondensedRDMStack, which stores only the values above the diagonal, or not.
+    store : string or None. Default is None.
+        The path of a .npy file for storing the RDMs on disk.
+        If store is not None, the RDMs are written to the file slab by slab along the x axis (as float32, condensed if
+        condensed=True) and an RDMStore is returned, so the RDMs never need to fit in the memory.
 
     Returns
     -------
-    RDM : array
+    RDM : array or CondensedRDMStack or RDMStore
         The fMRI-Searchlight RDM.
         The shape of RDMs is [n_x, n_y, n_z, n_cons, n_cons]. n_x, n_y, n_z represent the number of calculation units
         for searchlight along the x, y, z axis
+        If condensed=True, the shape of the CondensedRDMStack is [n_x, n_y, n_z].
+        If store is not None, return the read-only RDMStore with the shape [n_x, n_y, n_z].
     """
 
-    # get the number of conditions, subjects and the size of the fMRI-img
-    cons, subs, nx, ny, nz = np.shape(fmri_data)
-
-    # the size of the calculation units for searchlight
-    kx = ksize[0]
-    ky = ksize[1]
-    kz = ksize[2]
-
-    # strides for calculating along the x, y, z axis
-    sx = strides[0]
-    sy = strides[1]
-    sz = strides[2]
+    # get the number of conditions & subjects
+    cons, subs = np.shape(fmri_data)[:2]
 
-    # calculate the number of the calculation units in the x, y, z directions
-    n_x = int((nx - kx) / sx)+1
-    n_y = int((ny - ky) / sy)+1
-    n_z = int((nz - kz) / sz)+1
+    # the calculation units as a strided view: [n_cons, n_subs, n_x, n_y, n_z, kx, ky, kz]
+    patches = get_patches(np.asarray(fmri_data, dtype=np.float64), ksize=ksize, strides=strides)
+    n_x, n_y, n_z = patches.shape[2:5]
 
-    # initialize the data for calculating the RDM
-    data = np.full([n_x, n_y, n_z, cons, kx*ky*kz, subs], np.nan)
-
-    # assignment
+    # initialize the RDMs
+    if store is not None:
+        rdms = RDMStore.create(store, [n_x, n_y, n_z], cons, condensed=condensed, axes=["x", "y", "z"],
+                               params={"function": "fmriRDM", "ksize": [int(k) for k in ksize],
+                                       "strides": [int(k) for k in strides]})
+    elif condensed == True:
+        rdms = np.full([n_x, n_y, n_z, int(cons*(cons-1)/2)], np.nan)
+    else:
+        rdms = np.full([n_x, n_y, n_z, cons, cons], np.nan)
+
+    # calculate the RDMs slab by slab along the x axis
     for x in range(n_x):
-        for y in range(n_y):
-            for z in range(n_z):
-                for i in range(cons):
 
-                    index = 0
+        # the patterns: [n_cons, n_subs, n_y, n_z, kx, ky, kz] -> [n_y, n_z, n_cons, kx, ky, kz, n_subs]
+        #               -> [n_y, n_z, n_cons, kx*ky*kz*n_subs]
+        patterns = np.transpose(patches[:, :, x], (2, 3, 0, 4, 5, 6, 1))
+        patterns = np.reshape(patterns, [n_y, n_z, cons, -1])
 
-                    for k1 in range(kx):
-                        for k2 in range(ky):
-                            for k3 in range(kz):
-                                for j in range(subs):
-                                    data[x, y, z, i, index, j] = fmri_data[i, j, x+k1, y+k2, z+k3]
+        # the dissimilarities including NaN stay NaN
+        rdm = patternRDM(patterns, condensed=condensed)
 
-                                index = index + 1
+        if condensed == True and store is None:
+            rdms[x] = get_upper(rdm)
+        else:
+            rdms[x] = rdm
 
-    # flatten the data for different calculating conditions
-    data = np.reshape(data, [n_x, n_y, n_z, cons, kx*ky*kz*subs])
+    # reopen the written store read-only
+    if store is not None:
+        rdms.flush()
+        return RDMStore(store)
 
-    # initialize the RDMs
-    rdms = np.full([n_x, n_y, n_z, cons, cons], np.nan)
-
-    # calculate the values in RDMs
-    for x in range(n_x):
-        for y in range(n_y):
-            for z in range(n_z):
-                for i in range(cons):
-                    for j in range(cons):
-
-                        # no NaN
-                        if (np.isnan(data[x, y, z, i]).any() == False) and (np.isnan(data[x, y, z, j]).any() == False):
-                            # calculate the Pearson Coefficient
-                            r = pearsonr(data[x, y, z, i], data[x, y, z, j])[0]
-                            # calculate the dissimilarity
-                            rdms[x, y, z, i, j] = limtozero(1 - abs(r))
-                            print(rdms[x, y, z, i, j])
+    if condensed == True:
+        return CondensedRDMStack(rdms)
 
     return rdms
 
 
 ' a function for calculating the RDM based on fMRI data of a ROI '
 
-def fmriRDM_roi(fmri_data, mask_data):
+def fmriRDM_roi(fmri_data, mask_data, approx=False, n_components=1024, seed=0):
 
     """
     Calculate the Representational Dissimilarity Matrix - RDM(s) for fMRI data (for ROI)
@@ -662,60 +1337,62 @@ def fmriRDM_roi(fmri_data, mask_data):
     mask_data : array [nx, ny, nz].
         The mask data for region of interest (ROI)
         The size of the fMRI-img. nx, ny, nz represent the number of voxels along the x, y, z axis.
+    approx : bool True or False. Default is False.
+        Calculate the approximate RDM by a seeded sparse random projection of the patterns or not.
+        If approx=True, the voxels are read & projected slice by slice along the x axis to n_components dimensions
+        by a very sparse projection, so the patterns of the ROI are never held, and the bound on the distortion is
+        returned with the RDM. If the ROI has no more features (n_subs*n_voxels) than n_components, the patterns are
+        not projected and the RDM is exact.
+    n_components : int. Default is 1024.
+        The number of dimensions after the random projection. Only when approx=True, n_components works.
+    seed : int. Default is 0.
+        The seed of the random projection. Only when approx=True, seed works.
 
     Returns
     -------
     RDM : array
         The fMRI-ROI RDM.
         The shape of RDM is [n_cons, n_cons].
+    eps : float
+        Only when approx=True, return (RDM, eps). eps is the Johnson-Lindenstrauss bound on the distortion: with
+        probability at least 1 - 1/n_cons, the squared distances between the centered patterns are preserved within a
+        factor of (1 - eps, 1 + eps). See jl_distortion(). If the patterns are not projected, eps=0.
     """
 
     # get the number of conditions, subjects, the size of the fMRI-img
-    ncons, nsubs, nx, ny, nz = fmri_data.shape
+    ncons, nsubs, nx, ny, nz = np.shape(fmri_data)
 
-    # record the the number of voxels that is not 0 or NaN
-    n = 0
+    # the voxels that are not 0 or NaN
+    mask_data = np.asarray(mask_data)
+    valid = (mask_data != 0) & (np.isnan(mask_data) == False)
 
-    for i in range(nx):
-        for j in range(ny):
-            for k in range(nz):
+    # the patterns are only projected if they have more features than n_components
+    project = approx == True and nsubs*np.sum(valid) > n_components
 
-                # not 0 or NaN
-                if (mask_data[i, j, k] != 0) and (math.isnan(mask_data[i, j, k]) == False):
-                    n = n + 1
+    if project == True:
 
-    # initialize the data for calculating the RDM
-    data = np.zeros([ncons, nsubs, n], dtype=np.float)
+        # project the voxels slice by slice
+        stats = None
+        for x in range(nx):
+            if valid[x].any():
+                data = np.reshape(np.asarray(fmri_data[:, :, x])[:, :, valid[x]], [ncons, -1])
+                stats = _projection_update(stats, data, n_components, seed, n_features=nsubs*np.sum(valid))
 
-    # assignment
-    for p in range(ncons):
-        for q in range(nsubs):
+        rdm = _projection_rdms(stats)
 
-            n = 0
+    else:
 
-            for i in range(nx):
-                for j in range(ny):
-                    for k in range(nz):
+        # the patterns of the ROI: [n_cons, n_subs, n_voxels] -> [n_cons, n_subs*n_voxels]
+        data = np.reshape(np.asarray(fmri_data)[:, :, valid], [ncons, -1])
 
-                        # not 0 or NaN
-                        if (mask_data[i, j, k] != 0) and (math.isnan(mask_data[i, j, k]) == False):
-                            data[p, q, n] = fmri_data[p, q, i, j, k]
-                            n = n + 1
+        rdm = patternRDM(data)
 
-    # initialize the RDMs
-    rdm = np.zeros([ncons, ncons], dtype=np.float)
-
-    # flatten the data for different calculating conditions
-    data = np.reshape(data, [ncons, nsubs*n])
+    # the dissimilarities of the conditions including NaN are 0
+    rdm[np.isnan(rdm)] = 0
 
-    # calculate the values in RDM
-    for i in range(ncons):
-        for j in range(ncons):
+    if approx == True and project == False:
+        return rdm, 0.0
+    elif approx == True:
+        return rdm, jl_distortion(ncons, n_components)
 
-            if (np.isnan(data[i]).any() == False) and (np.isnan(data[j]).any() == False):
-                # calculate the Pearson Coefficient
-                r = pearsonr(data[i], data[j])[0]
-                # calculate the dissimilarity
-                rdm[i, j] = limtozero(1 - abs(r))
-
-    return rdm
\ No newline at end of file
+    return rdm
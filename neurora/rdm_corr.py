@@ -8,6 +8,10 @@ import numpy as np
 from scipy.stats import spearmanr
 from scipy.stats import pearsonr
 from scipy.stats import kendalltau
+from scipy.stats import t as tdist
+from scipy.linalg import solve_triangular
+from scipy.optimize import nnls
+from neurora.stuff import get_upper, rescale_vectors, rank_vectors, normalize_vectors, corr_pvalue
 
 
 ' a function for calculating the Spearman correlation coefficient between two RDMs '
@@ -612,3 +616,258 @@ def rdm_permutation(RDM1, RDM2, iter=1000, rescale=False):
     p = ni/iter
 
     return p
+
+
+' a function for getting the vectors used to compare RDMs '
+
+def rdm_vectors(RDMs, method="spearman", rescale=False):
+
+    """
+    Get the vectors used to compare RDMs from the values above the diagonal
+
+    Parameters
+    ----------
+    RDMs : array [..., ncons, ncons] or CondensedRDMStack
+        The RDM(s).
+        The shape of RDMs must be [..., n_cons, n_cons].
+        n_cons represent the number of conidtions.
+        If RDMs is a CondensedRDMStack, its stored values are used without extracting them.
+    method : string 'spearman' or 'pearson' or 'kendall' or 'similarity' or 'distance'. Default is 'spearman'.
+        The method the vectors will be used for.
+    rescale : bool True or False. Default is False.
+        Rescale the values in RDM or not.
+        Here, the maximum-minimum method is used to rescale the values except for the values on the diagonal.
+
+    Returns
+    -------
+    v : array [..., n_cons*(n_cons-1)/2]
+        The vectors.
+        If method='spearman' or 'pearson', the vectors are (ranked,) centered & normalized, so that the dot product of
+        two vectors is their correlation coefficient. If method='similarity', the vectors are normalized, so that the
+        dot product of two vectors is their Cosine Similarity. Otherwise, the vectors are the values above the diagonal.
+    """
+
+    # get the values above the diagonal of the RDMs
+    v = get_upper(RDMs).astype(np.float64)
+
+    if rescale == True:
+        v = rescale_vectors(v)
+
+    if method == "spearman":
+        return normalize_vectors(rank_vectors(v))
+    if method == "pearson":
+        return normalize_vectors(v)
+    if method == "similarity":
+        return normalize_vectors(v, center=False)
+
+    return v
+
+
+' a function for calculating the Similarities/Correlation Coefficients between a RDM and a batch of RDMs '
+
+def rdm_correlation_batch(RDM, RDMs, method="spearman", rescale=False):
+
+    """
+    Calculate the Similarities between a RDM and a batch of RDMs in one vectorized pass
+
+    Parameters
+    ----------
+    RDM : array [ncons, ncons]
+        The RDM.
+        The shape of RDM must be [n_cons, n_cons].
+        n_cons represent the number of conidtions.
+    RDMs : array [n, ncons, ncons]
+        The batch of RDMs.
+        The shape of RDMs must be [n, n_cons, n_cons].
+        n represents the number of RDMs in the batch.
+    method : string 'spearman' or 'pearson' or 'kendall' or 'similarity' or 'distance'. Default is 'spearman'.
+        The method to calculate the similarities.
+        If method='spearman', calculate the Spearman Correlations. If method='pearson', calculate the Pearson
+        Correlations. If methd='kendall', calculate the Kendall tau Correlations. If method='similarity', calculate the
+        Cosine Similarities. If method='distance', calculate the Euclidean Distances.
+    rescale : bool True or False. Default is False.
+        Rescale the values in RDM or not.
+        Here, the maximum-minimum method is used to rescale the values except for the values on the diagonal.
+
+    Returns
+    -------
+    corrs : array [n, 2].
+        The similarities between the RDM and each RDM in the batch.
+        2 represents a r-value and a p-value. If method='similarity' or method='distance', the p-values are all 0.
+        RDMs including NaN get NaN results.
+
+    Notes
+    -----
+    The Spearman & Pearson Correlations and the Cosine Similarities are computed as one matrix-vector product of the
+    normalized values above the diagonal. The Kendall tau Correlations are still calculated RDM by RDM.
+    """
+
+    # get the vectors of the RDMs
+    v1 = rdm_vectors(RDM, method=method, rescale=rescale)
+    v2 = rdm_vectors(RDMs, method=method, rescale=rescale)
+
+    return vectors_correlation(v1[np.newaxis], v2, method=method)[0]
+
+
+' a function for calculating the Similarities/Correlation Coefficients between two batches of RDM vectors '
+
+def vectors_correlation(v1, v2, method="spearman"):
+
+    """
+    Calculate the Similarities between every pair of vectors from two batches returned by rdm_vectors()
+
+    Parameters
+    ----------
+    v1 : array [m, n_values]
+        The vectors of m RDMs, returned by rdm_vectors().
+    v2 : array [n, n_values]
+        The vectors of n RDMs, returned by rdm_vectors() with the same method.
+    method : string 'spearman' or 'pearson' or 'kendall' or 'similarity' or 'distance'. Default is 'spearman'.
+        The method to calculate the similarities.
+
+    Returns
+    -------
+    corrs : array [m, n, 2].
+        The similarities between each pair of RDMs.
+        2 represents a r-value and a p-value. If method='similarity' or method='distance', the p-values are all 0.
+        Pairs including a RDM with NaN get NaN results.
+    """
+
+    # get the number of values above the diagonal
+    n = v1.shape[-1]
+
+    # initialize the corrs
+    corrs = np.zeros([v1.shape[0], v2.shape[0], 2], dtype=np.float64)
+
+    # RDMs including NaN
+    nan1 = np.isnan(v1).any(axis=-1)
+    nan2 = np.isnan(v2).any(axis=-1)
+
+    if method == "spearman" or method == "pearson":
+
+        # calculate the Correlations
+        r = np.dot(v1, v2.T)
+        corrs[:, :, 0] = r
+        corrs[:, :, 1] = corr_pvalue(r, n)
+
+    elif method == "kendall":
+
+        for i in range(v1.shape[0]):
+            for j in range(v2.shape[0]):
+                if nan1[i] == False and nan2[j] == False:
+                    corrs[i, j] = kendalltau(v1[i], v2[j])
+
+    elif method == "similarity":
+
+        # calculate the Cosine Similarities
+        corrs[:, :, 0] = 0.5 + 0.5 * np.dot(v1, v2.T)
+
+    elif method == "distance":
+
+        # calculate the Euclidean Distances by the norms of the differences, one row of v1 at a time
+        for i in range(v1.shape[0]):
+            corrs[i, :, 0] = np.linalg.norm(v2 - v1[i], axis=-1)
+
+    corrs[nan1] = np.nan
+    corrs[:, nan2] = np.nan
+
+    return corrs
+
+
+' a function for fitting multiple model RDMs to a stack of RDMs by multiple regression '
+
+def rdm_regression(model_RDMs, RDMs, method="pearson", rescale=False, nonneg=False):
+
+    """
+    Fit multiple model RDMs to a stack of RDMs by multiple regression & calculate the partial correlations
+
+    Parameters
+    ----------
+    model_RDMs : array [n_models, ncons, ncons]
+        The model RDMs used as the regressors.
+        The shape of model_RDMs must be [n_models, n_cons, n_cons].
+        n_models & n_cons represent the number of models & the number of conidtions.
+    RDMs : array [..., ncons, ncons]
+        The RDMs to be fitted, such as the RDMs for each time-point, channel or searchlight unit.
+        The shape of RDMs must be [..., n_cons, n_cons].
+    method : string 'pearson' or 'spearman'. Default is 'pearson'.
+        If method='pearson', fit the values above the diagonal. If method='spearman', fit the ranks of the values above
+        the diagonal.
+    rescale : bool True or False. Default is False.
+        Rescale the values in RDM or not.
+        Here, the maximum-minimum method is used to rescale the values except for the values on the diagonal.
+    nonneg : bool True or False. Default is False.
+        Constrain the betas of the model RDMs to be non-negative (non-negative least squares) or not.
+        The intercept is not constrained.
+
+    Returns
+    -------
+    betas : array [..., n_models].
+        The regression weights of the model RDMs for each RDM.
+    partial_rs : array [..., n_models, 2].
+        The partial correlations between each model RDM and each RDM, controlling for the other model RDMs.
+        2 represents a r-value and a p-value. They are based on the ordinary least squares fit, also when nonneg=True.
+
+    Notes
+    -----
+    The design matrix of the model RDMs is decomposed by QR only once and reused for the whole stack of RDMs. The
+    partial correlation of each model is obtained from its t-value: r = t / sqrt(t^2 + df).
+    """
+
+    if method == "spearman":
+        x = rank_vectors(rdm_vectors(model_RDMs, method="pearson", rescale=rescale))
+        y = rank_vectors(rdm_vectors(RDMs, method="pearson", rescale=rescale))
+    else:
+        x = rdm_vectors(model_RDMs, method="distance", rescale=rescale)
+        y = rdm_vectors(RDMs, method="distance", rescale=rescale)
+
+    # get the number of models & the number of values above the diagonal
+    n_models, n = x.shape
+
+    # flatten the leading axes: [..., n] -> [n_rdms, n]
+    shape = y.shape[:-1]
+    y = np.reshape(y, [-1, n])
+
+    # RDMs including NaN
+    nan = np.isnan(y).any(axis=-1)
+    y = np.where(nan[:, np.newaxis], 0, y)
+
+    # center the regressors & the RDMs to absorb the intercept
+    x = x - np.mean(x, axis=-1, keepdims=True)
+    y = y - np.mean(y, axis=-1, keepdims=True)
+
+    # QR decomposition of the design matrix: [n, n_models] = Q[n, n_models] * R[n_models, n_models]
+    q, r = np.linalg.qr(x.T)
+
+    # project the RDMs onto the columns of Q
+    qty = np.dot(y, q)
+
+    # ordinary least squares betas: R * betas = Q' * y
+    betas = solve_triangular(r, qty.T).T
+
+    # the degrees of freedom & the residual variance
+    df = n - n_models - 1
+    sse = np.sum(np.square(y), axis=-1) - np.sum(np.square(qty), axis=-1)
+    sigma2 = np.maximum(sse, 0) / df
+
+    # the diagonal of inv(X'X) = inv(R) * inv(R)'
+    rinv = solve_triangular(r, np.eye(n_models))
+    xtx_diag = np.sum(np.square(rinv), axis=-1)
+
+    # t-values -> partial correlations
+    t = betas / np.sqrt(sigma2[:, np.newaxis] * xtx_diag[np.newaxis])
+    partial_rs = np.zeros([y.shape[0], n_models, 2], dtype=np.float64)
+    partial_rs[:, :, 0] = t / np.sqrt(np.square(t) + df)
+    partial_rs[:, :, 1] = 2 * tdist.sf(np.abs(t), df)
+
+    if nonneg == True:
+
+        # non-negative least squares on the reduced problem: |R * betas - Q' * y|
+        for i in range(y.shape[0]):
+            if nan[i] == False:
+                betas[i] = nnls(r, qty[i])[0]
+
+    betas[nan] = np.nan
+    partial_rs[nan] = np.nan
+
+    return np.reshape(betas, shape + (n_models,)), np.reshape(partial_rs, shape + (n_models, 2))
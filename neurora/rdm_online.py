@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+' a module for calculating the RDM(s) online from streaming EEG-like epochs '
+
+__author__ = 'Zitong Lu'
+
+import numpy as np
+from neurora.rdm_cal import eeg_patterns, patternRDM
+
+np.seterr(divide='ignore', invalid='ignore')
+
+
+' a class for updating the RDM(s) epoch by epoch '
+
+class OnlineRDM(object):
+
+    """
+    The RDM(s) of EEG/MEG/fNIRS epochs updated online, epoch by epoch
+
+    Parameters
+    ----------
+    n_cons : int
+        The number of conditions.
+    n_chls : int
+        The number of channels.
+    n_ts : int
+        The number of time-points of each epoch.
+
+    Attributes
+    ----------
+    counts : array [n_cons]
+        The number of epochs of each condition.
+    means : array [n_cons, n_chls, n_ts]
+        The running averages of the epochs of each condition.
+    m2 : array [n_cons, n_chls, n_ts]
+        The running sums of the squared deviations from the averages (Welford).
+
+    Notes
+    -----
+    Each epoch updates the running average of its condition by Welford's method in O(n_chls*n_ts), so past epochs are
+    never reprocessed. The RDM(s) are calculated on demand from the averages in O(n_cons^2*n_chls*n_ts), the same as
+    eegRDM() with the averages as the trial-averaged data of one subject.
+    The conditions without epochs get NaN dissimilarities.
+    """
+
+    def __init__(self, n_cons, n_chls, n_ts):
+
+        self.counts = np.zeros([n_cons], dtype=np.int64)
+        self.means = np.zeros([n_cons, n_chls, n_ts], dtype=np.float64)
+        self.m2 = np.zeros([n_cons, n_chls, n_ts], dtype=np.float64)
+
+    def update(self, epoch, label):
+
+        """
+        Add an epoch
+
+        Parameters
+        ----------
+        epoch : array [n_chls, n_ts]
+            The data of the epoch.
+        label : int
+            The condition of the epoch, from 0 to n_cons-1.
+        """
+
+        epoch = np.asarray(epoch, dtype=np.float64)
+
+        if not 0 <= label < len(self.counts):
+            raise ValueError("label must be from 0 to n_cons-1 = %d" % (len(self.counts)-1))
+
+        if epoch.shape != self.means.shape[1:]:
+            raise ValueError("the shape of epoch must be [n_chls, n_ts] = %s" % (self.means.shape[1:],))
+
+        # Welford's update of the average & the squared deviations
+        self.counts[label] += 1
+        delta = epoch - self.means[label]
+        self.means[label] += delta / self.counts[label]
+        self.m2[label] += delta * (epoch - self.means[label])
+
+    def variance(self):
+
+        """
+        Get the sample variances of the epochs of each condition
+
+        Returns
+        -------
+        var : array [n_cons, n_chls, n_ts]
+            The variances. The conditions with less than 2 epochs get NaN.
+        """
+
+        # the conditions with less than 2 epochs have no variance
+        denom = np.where(self.counts < 2, np.nan, self.counts - 1)
+
+        return self.m2 / denom[:, np.newaxis, np.newaxis]
+
+    def rdm(self, chl_opt=0, time_opt=0, time_win=5, time_step=5):
+
+        """
+        Calculate the current RDM(s)
+
+        Parameters
+        ----------
+        chl_opt : int 0 or 1. Default is 0.
+            Calculate the RDM for each channel or not.
+        time_opt : int 0 or 1. Default is 0.
+            Calculate the RDMs for the time-windows or not.
+        time_win : int. Default is 5.
+            Set a time-window for calculating the RDM for different time-points. Only when time_opt=1, time_win works.
+        time_step : int. Default is 5.
+            The time step size for each time of calculating. Only when time_opt=1, time_step works.
+
+        Returns
+        -------
+        RDM(s) : array
+            The current RDM(s), the same shapes as eegRDM() with sub_opt=0.
+            If chl_opt=0 & time_opt=0, the shape is [n_cons, n_cons].
+            If chl_opt=0 & time_opt=1, the shape is [int((n_ts-time_win)/time_step)+1, n_cons, n_cons].
+            If chl_opt=1 & time_opt=0, the shape is [n_chls, n_cons, n_cons].
+            If chl_opt=1 & time_opt=1, the shape is [n_chls, int((n_ts-time_win)/time_step)+1, n_cons, n_cons].
+        """
+
+        # the averages of the conditions without epochs are NaN
+        means = np.where((self.counts > 0)[:, np.newaxis, np.newaxis], self.means, np.nan)
+
+        # the averages as the trial-averaged data of one subject: [n_cons, 1, n_chls, n_ts]
+        patterns = eeg_patterns(means[:, np.newaxis], sub_opt=0, chl_opt=chl_opt, time_opt=time_opt,
+                                time_win=time_win, time_step=time_step)
+
+        return patternRDM(patterns)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+' a module for storing RDMs compactly by the values above the diagonal '
+
+__author__ = 'Zitong Lu'
+
+import numpy as np
+
+
+' a class for a stack of RDMs stored by the values above the diagonal '
+
+class CondensedRDMStack(object):
+
+    """
+    A stack of RDMs stored by only the n_cons*(n_cons-1)/2 values above the diagonal
+
+    Parameters
+    ----------
+    values : array
+        The values above the diagonal of the RDMs in row-major order.
+        The shape of values must be [..., n_cons*(n_cons-1)/2].
+    dtype : data-type. Default is None.
+        The data-type of the values, such as np.float32 or np.float64.
+        If dtype=None, keep the data-type of values.
+
+    Attributes
+    ----------
+    values : array [..., n_pairs]
+        The values above the diagonal.
+    n_cons : int
+        The number of conditions.
+    n_pairs : int
+        The number of values above the diagonal of each RDM, n_cons*(n_cons-1)/2.
+    shape : tuple
+        The shape of the stack, values.shape[:-1].
+
+    Notes
+    -----
+    Compared to the full [..., n_cons, n_cons] RDMs, the memory is halved and no upper-triangle extraction is needed
+    when comparing the RDMs. np.asarray(stack) and stack.square() give the full RDMs, e.g. for plotting.
+    """
+
+    def __init__(self, values, dtype=None):
+
+        self.values = np.asarray(values, dtype=dtype)
+
+        # get the number of conditions from the number of values above the diagonal
+        self.n_pairs = self.values.shape[-1]
+        self.n_cons = int(round((1 + np.sqrt(1 + 8*self.n_pairs)) / 2))
+
+        if self.n_cons*(self.n_cons-1)//2 != self.n_pairs:
+            raise ValueError("the last axis of values must have n_cons*(n_cons-1)/2 elements")
+
+    @classmethod
+    def from_square(cls, rdms, dtype=None):
+
+        """
+        Build the stack from full RDMs of shape [..., n_cons, n_cons]
+        """
+
+        rdms = np.asarray(rdms)
+
+        # the indices of the values above the diagonal
+        i, j = np.triu_indices(rdms.shape[-1], k=1)
+
+        return cls(rdms[..., i, j], dtype=dtype)
+
+    @property
+    def shape(self):
+        return self.values.shape[:-1]
+
+    @property
+    def ndim(self):
+        return self.values.ndim - 1
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __getitem__(self, index):
+
+        # index the leading axes only
+        if not isinstance(index, tuple):
+            index = (index,)
+
+        return CondensedRDMStack(self.values[index + (Ellipsis, slice(None))])
+
+    def __repr__(self):
+        return "CondensedRDMStack(shape=%s, n_cons=%d, dtype=%s)" % (self.shape, self.n_cons, self.dtype)
+
+    def astype(self, dtype):
+
+        """
+        Return a copy of the stack with values of another data-type
+        """
+
+        return CondensedRDMStack(self.values.astype(dtype))
+
+    def reshape(self, shape):
+
+        """
+        Return the stack with new leading axes (a view when possible)
+        """
+
+        return CondensedRDMStack(np.reshape(self.values, tuple(shape) + (self.n_pairs,)))
+
+    def square(self):
+
+        """
+        Get the full RDMs
+
+        Returns
+        -------
+        rdms : array [..., n_cons, n_cons]
+            The full RDMs, with 0 on the diagonal.
+        """
+
+        # the indices of the values above the diagonal
+        i, j = np.triu_indices(self.n_cons, k=1)
+
+        rdms = np.zeros(self.shape + (self.n_cons, self.n_cons), dtype=self.dtype)
+        rdms[..., i, j] = self.values
+        rdms[..., j, i] = self.values
+
+        return rdms
+
+    def __array__(self, dtype=None, copy=None):
+
+        rdms = self.square()
+
+        if dtype is not None:
+            rdms = rdms.astype(dtype)
+
+        return rdms
+
+
+' a class for the lazy batches of a stack of RDMs '
+
+class RDMBatches(object):
+
+    """
+    A stack of RDMs calculated lazily batch by batch
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the leading axes of the stack.
+    n_cons : int
+        The number of conditions.
+    generate : function
+        A function returning a new generator of (index, rdms) for each iteration.
+
+    Notes
+    -----
+    Iterating over the batches yields (index, rdms). rdms is an array [b, n_cons, n_cons] of b RDMs and index is the
+    tuple of the arrays of their positions in the leading axes, so results can be assigned by results[index] = ....
+    The batches can be iterated more than once, and each iteration calculates the RDMs again. The functions in
+    corr_cal_by_rdm, such as rdms_corr(), accept the batches directly and only hold one batch at a time.
+    """
+
+    def __init__(self, shape, n_cons, generate):
+
+        self.shape = tuple(shape)
+        self.n_cons = n_cons
+        self._generate = generate
+
+    def __iter__(self):
+        return self._generate()
+
+    def __repr__(self):
+        return "RDMBatches(shape=%s, n_cons=%d)" % (self.shape, self.n_cons)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+' a module for storing RDMs on disk by memory-mapped .npy files '
+
+__author__ = 'Zitong Lu'
+
+import os
+import json
+import numpy as np
+from neurora.rdm_stack import CondensedRDMStack
+
+
+' a function for getting the path of the sidecar file of a store '
+
+def _sidecar_path(path):
+
+    return os.path.splitext(path)[0] + ".json"
+
+
+' a class for a stack of RDMs stored on disk '
+
+class RDMStore(object):
+
+    """
+    A stack of RDMs stored on disk by a .npy file & a JSON sidecar
+
+    Parameters
+    ----------
+    path : string
+        The path of the .npy file. The sidecar is the .json file with the same name.
+    mode : string 'r' or 'r+'. Default is 'r'.
+        Open the store read-only or for reading & writing.
+
+    Attributes
+    ----------
+    rdms : np.memmap
+        The memory-mapped RDMs.
+        The shape is [..., n_pairs] if the store is condensed, and [..., n_cons, n_cons] if not.
+    meta : dict
+        The metadata in the sidecar, including 'n_cons', 'condensed', 'shape', 'dtype', 'axes' & 'params'.
+    shape : tuple
+        The shape of the leading axes of the stack.
+
+    Notes
+    -----
+    The RDMs are read from disk only when they are indexed, so stores larger than the memory can be written chunk by
+    chunk (e.g. by fmriRDM(store=...)) and compared with model RDMs block by block (e.g. by rdms_corr).
+    """
+
+    def __init__(self, path, mode="r"):
+
+        with open(_sidecar_path(path), "r") as f:
+            self.meta = json.load(f)
+
+        self.path = path
+        self.rdms = np.lib.format.open_memmap(path, mode=mode)
+        self.n_cons = self.meta["n_cons"]
+        self.condensed = self.meta["condensed"]
+
+    @classmethod
+    def create(cls, path, shape, n_cons, condensed=True, dtype=np.float32, axes=None, params=None):
+
+        """
+        Create an empty store on disk & open it for writing
+
+        Parameters
+        ----------
+        path : string
+            The path of the .npy file.
+        shape : tuple
+            The shape of the leading axes of the stack, such as [n_x, n_y, n_z] or [n_subs, n_chls, n_ts].
+        n_cons : int
+            The number of conditions.
+        condensed : bool True or False. Default is True.
+            Store only the values above the diagonal of the RDMs or not.
+        dtype : data-type. Default is np.float32.
+            The data-type of the stored values.
+        axes : list of string or None. Default is None.
+            The names of the leading axes.
+        params : dict or None. Default is None.
+            The parameters used to calculate the RDMs. The values must be JSON serializable.
+
+        Returns
+        -------
+        store : RDMStore
+            The store opened for reading & writing. Unwritten RDMs are 0.
+        """
+
+        shape = tuple(int(n) for n in shape)
+
+        if condensed == True:
+            full_shape = shape + (int(n_cons*(n_cons-1)/2),)
+        else:
+            full_shape = shape + (n_cons, n_cons)
+
+        meta = {"n_cons": int(n_cons),
+                "condensed": bool(condensed),
+                "shape": list(shape),
+                "dtype": np.dtype(dtype).name,
+                "axes": axes,
+                "params": params}
+
+        with open(_sidecar_path(path), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        rdms = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=full_shape)
+        del rdms
+
+        return cls(path, mode="r+")
+
+    @property
+    def shape(self):
+        return tuple(self.meta["shape"])
+
+    @property
+    def dtype(self):
+        return self.rdms.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return "RDMStore(path=%r, shape=%s, n_cons=%d, condensed=%s)" % (self.path, self.shape, self.n_cons,
+                                                                          self.condensed)
+
+    def __getitem__(self, index):
+
+        # read the indexed RDMs into memory
+        if not isinstance(index, tuple):
+            index = (index,)
+
+        rdms = np.array(self.rdms[index + (Ellipsis,)])
+
+        if self.condensed == True:
+            return CondensedRDMStack(rdms)
+
+        return rdms
+
+    def __setitem__(self, index, rdms):
+
+        # write RDMs (full, condensed or a CondensedRDMStack) into the store
+        if not isinstance(index, tuple):
+            index = (index,)
+
+        if self.condensed == True:
+            if not isinstance(rdms, CondensedRDMStack):
+                rdms = CondensedRDMStack.from_square(rdms)
+            rdms = rdms.values
+        else:
+            rdms = np.asarray(rdms)
+
+        self.rdms[index + (Ellipsis,)] = rdms
+
+    def flat(self):
+
+        """
+        Get the memory-mapped RDMs with the leading axes flattened, without reading them
+
+        Returns
+        -------
+        rdms : CondensedRDMStack [n] or np.memmap [n, n_cons, n_cons]
+            The flattened RDMs still backed by the file.
+        """
+
+        if self.condensed == True:
+            return CondensedRDMStack(np.reshape(self.rdms, [-1, self.rdms.shape[-1]]))
+
+        return np.reshape(self.rdms, [-1, self.n_cons, self.n_cons])
+
+    def flush(self):
+
+        """
+        Write the changes to disk
+        """
+
+        self.rdms.flush()
+
+    def load(self):
+
+        """
+        Read all RDMs into memory
+
+        Returns
+        -------
+        rdms : array or CondensedRDMStack
+            The RDMs, with the shape [..., n_cons, n_cons] or [...].
+        """
+
+        return self[()]
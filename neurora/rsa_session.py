@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+' a module for running repeated RSA analyses on the same data while reusing the intermediate results '
+
+__author__ = 'Zitong Lu'
+
+import numpy as np
+from neurora.stuff import normalize_vectors
+from neurora.rdm_cal import bhvRDM, eeg_patterns, patternRDM, _average_trials
+from neurora.rdm_corr import rdm_vectors, vectors_correlation
+
+np.seterr(divide='ignore', invalid='ignore')
+
+
+' a class for an analysis session of EEG-like & behavioral data '
+
+class RSASession(object):
+
+    """
+    An analysis session holding the raw data & lazily memoizing the intermediate results
+
+    Parameters
+    ----------
+    eeg_data : array or RaggedTrials
+        The EEG/MEG/fNIRS data.
+        The shape of eeg_data must be [n_cons, n_subs, n_trials, n_chls, n_ts].
+    bhv_data : array or None. Default is None.
+        The behavioral data.
+        The shape of bhv_data must be [n_cons, n_subs, n_trials].
+
+    Notes
+    -----
+    Each stage - the trial averages, the (windowed) patterns, the normalized patterns, the RDMs & the (ranked) vectors
+    of the values above the diagonal - is calculated at most once for each set of parameters it depends on. So
+    repeated analyses with other methods, rescaling or model RDMs skip the expensive stages, and the analyses of
+    subsets of channels reuse the trial averages.
+    The memoized results are returned without copying, so they should not be modified in place.
+    """
+
+    def __init__(self, eeg_data, bhv_data=None):
+
+        self.eeg_data = eeg_data
+        self.bhv_data = bhv_data
+        self._memo = {}
+
+    def _get(self, key, func):
+
+        # calculate the result at the first request only
+        if key not in self._memo:
+            self._memo[key] = func()
+
+        return self._memo[key]
+
+    def clear(self):
+
+        """
+        Remove all memoized results
+        """
+
+        self._memo = {}
+
+    def avgdata(self, chls=None):
+
+        """
+        Get the trial-averaged data
+
+        Parameters
+        ----------
+        chls : list of int or None. Default is None.
+            The indices of the channels used. If chls=None, use all channels.
+
+        Returns
+        -------
+        avgdata : array [n_cons, n_subs, n_chls, n_ts]
+            The trial-averaged data.
+        """
+
+        # average all channels once, the subsets are indexed from it
+        avgdata = self._get(("avgdata",), lambda: _average_trials(self.eeg_data))
+
+        if chls is None:
+            return avgdata
+
+        return self._get(("avgdata", tuple(chls)), lambda: avgdata[:, :, list(chls)])
+
+    def patterns(self, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5, chls=None):
+
+        """
+        Get the patterns for calculating the RDM(s), the same as eeg_patterns() of the trial-averaged data
+        """
+
+        key = ("patterns", sub_opt, chl_opt, time_opt, time_win, time_step, _chls_key(chls))
+
+        return self._get(key, lambda: eeg_patterns(self.avgdata(chls), sub_opt=sub_opt, chl_opt=chl_opt,
+                                                   time_opt=time_opt, time_win=time_win, time_step=time_step))
+
+    def normalized_patterns(self, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5, chls=None):
+
+        """
+        Get the centered & normalized patterns
+        """
+
+        key = ("normalized", sub_opt, chl_opt, time_opt, time_win, time_step, _chls_key(chls))
+
+        return self._get(key, lambda: normalize_vectors(self.patterns(sub_opt, chl_opt, time_opt, time_win, time_step,
+                                                                      chls)))
+
+    def rdms(self, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5, chls=None):
+
+        """
+        Get the RDM(s), the same as eegRDM() with the same parameters on the selected channels
+
+        Returns
+        -------
+        RDM(s) : array [..., n_cons, n_cons]
+            The EEG/MEG/fNIRS RDM(s).
+        """
+
+        key = ("rdms", sub_opt, chl_opt, time_opt, time_win, time_step, _chls_key(chls))
+
+        return self._get(key, lambda: patternRDM(self.normalized_patterns(sub_opt, chl_opt, time_opt, time_win,
+                                                                          time_step, chls), normalized=True))
+
+    def vectors(self, method="spearman", rescale=False, sub_opt=0, chl_opt=0, time_opt=0, time_win=5, time_step=5,
+                chls=None):
+
+        """
+        Get the (ranked) vectors of the values above the diagonal of the RDM(s), the same as rdm_vectors()
+
+        Returns
+        -------
+        v : array [..., n_cons*(n_cons-1)/2]
+            The vectors.
+        """
+
+        key = ("vectors", method, rescale, sub_opt, chl_opt, time_opt, time_win, time_step, _chls_key(chls))
+
+        return self._get(key, lambda: rdm_vectors(self.rdms(sub_opt, chl_opt, time_opt, time_win, time_step, chls),
+                                                  method=method, rescale=rescale))
+
+    def bhv_rdms(self, sub_opt=0):
+
+        """
+        Get the behavioral RDM(s), the same as bhvRDM()
+        """
+
+        return self._get(("bhv_rdms", sub_opt), lambda: bhvRDM(self.bhv_data, sub_opt=sub_opt))
+
+    def corr(self, model_rdm=None, method="spearman", rescale=False, sub_opt=0, chl_opt=0, time_opt=0, time_win=5,
+             time_step=5, chls=None):
+
+        """
+        Calculate the Similarities between the RDM(s) & a model RDM or the behavioral RDM(s)
+
+        Parameters
+        ----------
+        model_rdm : array [n_cons, n_cons] or None. Default is None.
+            A model RDM. If model_rdm=None, use the behavioral RDM(s) like bhvANDeeg_corr(): with sub_opt=1, each
+            subject's RDMs are compared with the subject's own behavioral RDM.
+        method : string 'spearman' or 'pearson' or 'kendall' or 'similarity' or 'distance'. Default is 'spearman'.
+            The method to calculate the similarities.
+        rescale : bool True or False. Default is False.
+            Rescale the values in RDM or not.
+        sub_opt, chl_opt, time_opt, time_win, time_step :
+            The same as eegRDM().
+        chls : list of int or None. Default is None.
+            The indices of the channels used. If chls=None, use all channels.
+
+        Returns
+        -------
+        corrs : array [..., 2]
+            The similarities, with the leading axes of the RDM(s). 2 represents a r-value and a p-value. If
+            method='similarity' or method='distance', the p-values are all 0.
+        """
+
+        # the vectors of the RDM(s): [..., n_values]
+        v = self.vectors(method, rescale, sub_opt, chl_opt, time_opt, time_win, time_step, chls)
+        shape = v.shape[:-1]
+
+        if model_rdm is not None:
+            model_v = rdm_vectors(model_rdm, method=method, rescale=rescale)[np.newaxis]
+        else:
+            model_v = self._get(("bhv_vectors", sub_opt, method, rescale),
+                                lambda: np.reshape(rdm_vectors(self.bhv_rdms(sub_opt), method=method, rescale=rescale),
+                                                   [-1, v.shape[-1]]))
+
+        # each subject's RDMs with the subject's behavioral RDM
+        if model_rdm is None and sub_opt == 1:
+            corrs = [vectors_correlation(model_v[i:i+1], np.reshape(v[i], [-1, v.shape[-1]]), method=method)[0]
+                     for i in range(shape[0])]
+            return np.reshape(np.array(corrs), shape + (2,))
+
+        corrs = vectors_correlation(model_v, np.reshape(v, [-1, v.shape[-1]]), method=method)[0]
+
+        return np.reshape(corrs, shape + (2,))
+
+
+' a function for getting the key of a subset of channels '
+
+def _chls_key(chls):
+
+    if chls is None:
+        return None
+
+    return tuple(chls)
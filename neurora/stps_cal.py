@@ -5,13 +5,62 @@
 __author__ = 'Zitong Lu'
 
 import numpy as np
-from scipy.stats import pearsonr
-import statsmodels.stats.weightstats as sw
-import math
+from scipy.stats import norm
+from neurora.stuff import get_windows, normalize_vectors, get_upper
 
 np.seterr(divide='ignore', invalid='ignore')
 
 
+' a function for calculating the Fisher Z scores of the similarities between trials '
+
+def _fisherz_upper(data, time_win, time_step):
+
+    # get the number of subjects, channels & trials
+    subs, chls, trials = np.shape(data)[:3]
+
+    # the feature vectors as a strided view: [n_subs, n_chls, n_trials, n_ts] -> [n_subs, n_chls, n_trials, ts, time_win]
+    feature_vectors = get_windows(data, time_win=time_win, time_step=time_step)
+    ts = feature_vectors.shape[3]
+
+    # reshape the feature_vectors
+    # shape pf feature_vectors: [subs, chls, trials, ts, time_win] -> [chls, ts, trials, subs, time_win]
+    #                           -> [chls, ts, trials, subs*time_win]
+    feature_vectors = np.transpose(feature_vectors, (1, 3, 2, 0, 4))
+    feature_vectors = np.reshape(feature_vectors, [chls, ts, trials, subs*time_win])
+
+    # z-score each trial's feature vector & calculate the correlation matrices by one matrix product
+    feature_vectors = normalize_vectors(feature_vectors)
+    correlation_matrices = np.matmul(feature_vectors, np.swapaxes(feature_vectors, -1, -2))
+
+    # get the values above the diagonal & convert them to Fisher's Z scores
+    return np.arctanh(get_upper(correlation_matrices))
+
+
+' a function for the two-sample Z-test along the last axis '
+
+def _ztest(x1, x2):
+
+    return _ztest_stats(np.mean(x1, axis=-1), np.var(x1, axis=-1), x1.shape[-1],
+                        np.mean(x2, axis=-1), np.var(x2, axis=-1), x2.shape[-1])
+
+
+' a function for the two-sample Z-test from the means & variances of the samples '
+
+def _ztest_stats(mean1, var1, n1, mean2, var2, n2):
+
+    # the pooled variance (as statsmodels.stats.weightstats.ztest with usevar='pooled')
+    var = (n1 * var1 + n2 * var2) / (n1 + n2 - 2)
+    var = var * (1.0 / n1 + 1.0 / n2)
+
+    # initialize the z-values & p-values
+    zp = np.zeros(np.shape(mean1) + (2,), dtype=np.float64)
+
+    zp[..., 0] = (mean1 - mean2) / np.sqrt(var)
+    zp[..., 1] = 2 * norm.sf(np.abs(zp[..., 0]))
+
+    return zp
+
+
 ' a function for calculating the spatiotemporal pattern similarities (STPS) '
 
 def stps(data1, data2, time_win=20, time_step=1):
@@ -34,7 +83,7 @@ def stps(data1, data2, time_win=20, time_step=1):
     time_win : int. Default is 20.
         Set a time-window for calculating the STPS for different time-points.
         If time_win=20, that means each calculation process based on 20 time-points.
-    time_step : int. Default is 5.
+    time_step : int. Default is 1.
         The time step size for each time of calculating.
 
     Returns
@@ -42,130 +91,177 @@ def stps(data1, data2, time_win=20, time_step=1):
     stps : array
         The STPS.
         The shape of stps is [n_chls, int((n_ts-time_win)/time_step)+1, 2].
-        2 representation a t-value and a p-value.
+        2 representation a z-value and a p-value.
+
+    Notes
+    -----
+    The trial-by-trial correlation matrices of all channels & time-windows are calculated by matrix products of the
+    z-scored feature vectors, and the Z-tests are calculated for all channels & time-windows at once.
     """
 
-    # for data1
+    # the Fisher's Z scores of the similarities between trials: [n_chls, ts, n_trials*(n_trials-1)/2]
+    correlations1 = _fisherz_upper(data1, time_win, time_step)
+    correlations2 = _fisherz_upper(data2, time_win, time_step)
 
-    # get the number of subjects, channels & trials of data1
-    subs1, chls, trials1 = np.shape(data1)[:3]
+    # Z-test for all channels & time-windows
+    return _ztest(correlations1, correlations2)
 
-    # the time-points for calculating NPS
-    ts = np.shape(data1)[3]
-    ts = int((ts - time_win) / time_step) + 1
 
-    # initialize the feature vectors
-    feature_vectors1 = np.zeros([subs1, chls, trials1, ts, time_win], dtype=np.float)
+' a function for getting the masks of the trial pairs for STPS '
 
-    # assigment
-    for i in range(subs1):
-        for j in range(chls):
-            for k in range(trials1):
-                for l in range(ts):
-                    feature_vectors1[i, j, k, l] = data1[i, j, k, l*time_step:l*time_step+time_win]
+def stps_masks(labels1, labels2):
 
-    # initialize the correlation matrices
-    correlation_matrices1 = np.zeros([chls, ts, trials1, trials1], dtype=np.float)
+    """
+    Get the boolean masks of different categories of trial pairs in the stacked trial correlation matrix
 
-    # reshape the feature_vectors
-    # shape pf feature_vectors: [subs1, chls, trials1, ts, time_win] -> [chls, ts, trials1, subs1, time_win]
-    #                           -> [chls, ts, trials1, subs1*time_win]
-    feature_vectors1 = np.transpose(feature_vectors1, (1, 3, 2, 0, 4))
-    feature_vectors1 = np.reshape(feature_vectors1, [chls, ts, trials1, subs1*time_win])
+    Parameters
+    ----------
+    labels1 : array [n_trials1]
+        The item labels of the trials of data1, such as the items at encoding.
+    labels2 : array [n_trials2]
+        The item labels of the trials of data2, such as the items at retrieval.
 
-    # calculate the correlation matrices
-    for i in range(chls):
-        for j in range(ts):
-            for k in range(trials1):
-                for l in range(trials1):
-                    r = pearsonr(feature_vectors1[i, j, k], feature_vectors1[i, j, l])[0]
-                    correlation_matrices1[i, j, k, l] = r
+    Returns
+    -------
+    masks : dict
+        The masks of shape [n_trials1+n_trials2, n_trials1+n_trials2]. The trials of data1 come first.
+        'within1' & 'within2' : the pairs of different trials within data1 & within data2.
+        'between' : all pairs of one trial of data1 & one trial of data2.
+        'match' : the pairs of one trial of data1 & one trial of data2 with the same item label.
+        'nonmatch' : the pairs of one trial of data1 & one trial of data2 with different item labels.
+    """
 
-    # calculate the number of values above the diagonal
-    n1 = int(trials1*(trials1-1)/2)
+    labels1 = np.asarray(labels1)
+    labels2 = np.asarray(labels2)
 
-    # initialize the correlations1
-    correlations1 = np.zeros([chls, ts, n1], dtype=np.float)
+    # get the number of trials
+    n1 = len(labels1)
+    n = n1 + len(labels2)
 
-    # assignment
-    index = 0
-    for i in range(chls):
-        for j in range(ts):
-            for k in range(trials1):
-                for l in range(trials1):
+    # the positions of the pairs
+    upper = np.triu(np.ones([n, n], dtype=bool), k=1)
+    in1 = np.arange(n) < n1
+    within1 = upper & in1[:, None] & in1[None, :]
+    within2 = upper & ~in1[:, None] & ~in1[None, :]
+    between = in1[:, None] & ~in1[None, :]
 
-                    if l > k:
-                        correlations1[index] = correlation_matrices1[i, j, k, l]
-                        index = index + 1
+    # the pairs with the same item label
+    labels = np.concatenate([labels1, labels2])
+    same = labels[:, None] == labels[None, :]
 
-    # convert correlations1 to Fisher's Z scores
-    correlations1 = 0.5*math.log((1+correlations1)/(1-correlations1))
+    return {"within1": within1, "within2": within2, "between": between,
+            "match": between & same, "nonmatch": between & ~same}
 
 
-    # for data2
+' a function for calculating the spatiotemporal pattern similarities (STPS) between trial-pair categories '
 
-    # get the number of subjects, channels & trials of data2
-    subs2, chls, trials2 = np.shape(data2)[:3]
+def stps_cross(data1, data2, labels1, labels2, contrasts=None, masks=None, time_win=20, time_step=1, mem_budget=2**28):
 
-    # the time-points for calculating NPS
-    ts = np.shape(data2)[3]
-    ts = int((ts - time_win) / time_step) + 1
+    """
+    calculate the spatiotemporal pattern similarities (STPS) between categories of trial pairs, such as the
+    encoding-retrieval similarities of matching vs. non-matching items
 
-    # initialize the feature vectors
-    feature_vectors2 = np.zeros([subs2, chls, trials2, ts, time_win], dtype=np.float)
+    Parameters
+    ----------
+    data1 : array
+        The data under condition 1, such as the encoding data.
+        The shape of data1 must be [n_subs, n_chls, n_trials1, n_ts].
+    data2 : array
+        The data under condition 2, such as the retrieval data.
+        The shape of data2 must be [n_subs, n_chls, n_trials2, n_ts].
+    labels1 : array [n_trials1]
+        The item labels of the trials of data1.
+    labels2 : array [n_trials2]
+        The item labels of the trials of data2.
+    contrasts : None or list of (category1, category2). Default is None.
+        The pairs of trial-pair categories to be compared by Z-test.
+        If contrasts=None, compare 'match' with 'nonmatch'.
+    masks : dict or None. Default is None.
+        The boolean masks [n_trials1+n_trials2, n_trials1+n_trials2] of the trial-pair categories.
+        If masks=None, use stps_masks(labels1, labels2). Custom masks can be added to the dict.
+    time_win : int. Default is 20.
+        Set a time-window for calculating the STPS for different time-points.
+    time_step : int. Default is 1.
+        The time step size for each time of calculating.
+    mem_budget : int. Default is 2**28 (256 MB).
+        The approximate memory budget in bytes for the feature vectors & the correlation matrices of each block of
+        (channel, time-window) pairs. At least one pair is calculated at a time, which costs about
+        8*(2*n_trials*n_subs*time_win + 3*n_trials^2) bytes with n_trials = n_trials1+n_trials2.
 
-    # assigment
-    for i in range(subs2):
-        for j in range(chls):
-            for k in range(trials2):
-                for l in range(ts):
-                    feature_vectors2[i, j, k, l] = data2[i, j, k, l * time_step:l * time_step + time_win]
+    Returns
+    -------
+    stps : array
+        The STPS.
+        If contrasts=None, the shape of stps is [n_chls, int((n_ts-time_win)/time_step)+1, 2].
+        Otherwise, the shape of stps is [n_contrasts, n_chls, int((n_ts-time_win)/time_step)+1, 2].
+        2 representation a z-value and a p-value.
+
+    Notes
+    -----
+    The trials of data1 & data2 are stacked and one trial correlation matrix is calculated for each channel and
+    time-window, which serves all categories & contrasts. The (channel, time-window) pairs are calculated block by
+    block within mem_budget.
+    """
 
-    # initialize the correlation matrices
-    correlation_matrices2 = np.zeros([chls, ts, trials2, trials2], dtype=np.float)
+    if masks is None:
+        masks = stps_masks(labels1, labels2)
 
-    # reshape the feature_vectors
-    # shape pf feature_vectors: [subs2, chls, trials2, ts, time_win] -> [chls, ts, trials2, subs2, time_win]
-    #                           -> [chls, ts, trials2, subs2*time_win]
-    feature_vectors2 = np.transpose(feature_vectors2, (1, 3, 2, 0, 4))
-    feature_vectors2 = np.reshape(feature_vectors2, [chls, ts, trials2, subs2 * time_win])
-
-    # calculate the correlation matrices
-    for i in range(chls):
-        for j in range(ts):
-            for k in range(trials2):
-                for l in range(trials2):
-                    r = pearsonr(feature_vectors2[i, j, k], feature_vectors2[i, j, l])[0]
-                    correlation_matrices2[i, j, k, l] = r
-
-    # calculate the number of values above the diagonal
-    n2 = int(trials2 * (trials2 - 1) / 2)
-
-    # initialize the correlations2
-    correlations2 = np.zeros([chls, ts, n2], dtype=np.float)
-
-    # assignment
-    index = 0
-    for i in range(chls):
-        for j in range(ts):
-            for k in range(trials2):
-                for l in range(trials2):
-
-                    if l > k:
-                        correlations2[index] = correlation_matrices2[i, j, k, l]
-                        index = index + 1
-
-    # convert correlations1 to Fisher's Z scores
-    correlations2 = 0.5 * math.log((1 + correlations2) / (1 - correlations2))
-
-    # initialize the STPS
-    stps = np.zeros([chls, ts, 2])
-
-    # calculate the STPS
-    for i in range(chls):
-        for j in range(ts):
-
-            # Z-test
-            stps[i, j] = sw.ztest(correlations1[i, j], correlations2[i, j])
+    if contrasts is None:
+        pairs = [("match", "nonmatch")]
+    else:
+        pairs = contrasts
+
+    # the categories used & their positions in the stacked trial correlation matrix
+    categories = sorted(set([c for pair in pairs for c in pair]))
+    positions = dict([(c, np.nonzero(masks[c])) for c in categories])
+
+    # stack the trials: [n_subs, n_chls, n_trials1+n_trials2, n_ts]
+    data = np.concatenate([data1, data2], axis=2)
+    subs, chls, trials = data.shape[:3]
+
+    # the time-windows as a view: [n_subs, n_chls, n_trials, ts, time_win]
+    windows = get_windows(data, time_win=time_win, time_step=time_step)
+    ts = windows.shape[3]
+
+    # the number of (channel, time-window) pairs in each block
+    # each pair costs its feature vectors (& the normalized copy), its correlation matrix & the Fisher's Z scores
+    block = max(1, int(mem_budget / (8 * (2*trials*subs*time_win + 3*trials*trials))))
+
+    # the means & variances of the Fisher's Z scores of each category: [n_chls*ts]
+    means = dict([(c, np.zeros([chls*ts], dtype=np.float64)) for c in categories])
+    variances = dict([(c, np.zeros([chls*ts], dtype=np.float64)) for c in categories])
+
+    for start in range(0, chls*ts, block):
+
+        # the channels & the time-windows of the pairs in the block
+        ci, wi = np.divmod(np.arange(start, min(start+block, chls*ts)), ts)
+
+        # the feature vectors: [b, subs, trials, time_win] -> [b, trials, subs*time_win]
+        feature_vectors = np.transpose(windows[:, ci, :, wi], (0, 2, 1, 3))
+        feature_vectors = np.reshape(feature_vectors, [len(ci), trials, subs*time_win])
+
+        # the trial correlation matrices: [b, trials, trials]
+        feature_vectors = normalize_vectors(feature_vectors)
+        correlation_matrices = np.matmul(feature_vectors, np.swapaxes(feature_vectors, -1, -2))
+        del feature_vectors
+
+        for c in categories:
+
+            # the Fisher's Z scores of the category: [b, n_pairs]
+            z = np.arctanh(correlation_matrices[..., positions[c][0], positions[c][1]])
+
+            means[c][start:start+len(ci)] = np.mean(z, axis=-1)
+            variances[c][start:start+len(ci)] = np.var(z, axis=-1)
+
+    for c in categories:
+        means[c] = np.reshape(means[c], [chls, ts])
+        variances[c] = np.reshape(variances[c], [chls, ts])
+
+    # Z-test for each contrast
+    stps = np.stack([_ztest_stats(means[c1], variances[c1], len(positions[c1][0]),
+                                  means[c2], variances[c2], len(positions[c2][0])) for c1, c2 in pairs])
+
+    if contrasts is None:
+        return stps[0]
 
     return stps
@@ -8,6 +8,10 @@ import nibabel as nib
 import numpy as np
 import os
 import math
+from scipy.stats import rankdata
+from scipy.stats import t as tdist
+from scipy.sparse import csr_matrix
+from neurora.rdm_stack import CondensedRDMStack
 
 # get package abspath
 package_root = os.path.dirname(os.path.abspath(__file__))
@@ -35,6 +39,381 @@ def limtozero(x):
     return x
 
 
+' a function for getting the values above the diagonal of RDM(s) '
+
+def get_upper(rdms):
+
+    """
+    get the values above the diagonal of RDM(s)
+
+    Parameters
+    ----------
+    rdms : array or CondensedRDMStack
+        The RDM(s). The shape must be [..., n_cons, n_cons].
+
+    Returns
+    -------
+    v : array
+        The values above the diagonal in row-major order.
+        The shape of v is [..., n_cons*(n_cons-1)/2].
+    """
+
+    # the values are already stored
+    if isinstance(rdms, CondensedRDMStack):
+        return rdms.values
+
+    rdms = np.asarray(rdms)
+
+    # get number of conditions
+    cons = rdms.shape[-1]
+
+    # the indices of the values above the diagonal
+    i, j = np.triu_indices(cons, k=1)
+
+    return rdms[..., i, j]
+
+
+' a function for rescaling vectors by the maximum-minimum method '
+
+def rescale_vectors(v):
+
+    """
+    rescale vectors to [0, 1] by the maximum-minimum method along the last axis
+
+    Parameters
+    ----------
+    v : array
+        The vectors. The shape must be [..., n].
+
+    Returns
+    -------
+    v : array
+        The rescaled vectors. Vectors with the same maximum & minimum are returned unchanged.
+    """
+
+    v = np.asarray(v, dtype=np.float64)
+
+    # get max & min
+    maxvalue = np.max(v, axis=-1, keepdims=True)
+    minvalue = np.min(v, axis=-1, keepdims=True)
+    scale = maxvalue - minvalue
+
+    # rescale
+    valid = scale != 0
+
+    return np.where(valid, (v - minvalue) / np.where(valid, scale, 1), v)
+
+
+' a function for ranking vectors along the last axis '
+
+def rank_vectors(v):
+
+    """
+    rank vectors along the last axis (ties get the average rank)
+
+    Parameters
+    ----------
+    v : array
+        The vectors. The shape must be [..., n].
+
+    Returns
+    -------
+    ranks : array
+        The ranks, starting from 1. Vectors including NaN are returned as NaN.
+    """
+
+    v = np.asarray(v, dtype=np.float64)
+
+    ranks = rankdata(v, axis=-1).astype(np.float64)
+    ranks[np.isnan(v).any(axis=-1)] = np.nan
+
+    return ranks
+
+
+' a function for normalizing vectors along the last axis '
+
+def normalize_vectors(v, center=True):
+
+    """
+    normalize vectors to unit length along the last axis
+
+    Parameters
+    ----------
+    v : array
+        The vectors. The shape must be [..., n].
+    center : bool True or False. Default is True.
+        Subtract the mean of each vector or not.
+        If center=True, the dot product of two normalized vectors is their Pearson Coefficient.
+        If center=False, the dot product of two normalized vectors is their Cosine Similarity.
+
+    Returns
+    -------
+    v : array
+        The normalized vectors.
+    """
+
+    v = np.array(v, dtype=np.float64)
+
+    if center == True:
+        v -= np.mean(v, axis=-1, keepdims=True)
+
+    v /= np.linalg.norm(v, axis=-1, keepdims=True)
+
+    return v
+
+
+' a function for calculating the p-values of correlation coefficients '
+
+def corr_pvalue(r, n):
+
+    """
+    calculate the two-sided p-values of correlation coefficients
+
+    Parameters
+    ----------
+    r : array
+        The correlation coefficients.
+    n : int or array
+        The number of observations used to calculate each coefficient.
+
+    Returns
+    -------
+    p : array
+        The p-values, based on a t-distribution with n-2 degrees of freedom (as in scipy.stats.pearsonr/spearmanr).
+    """
+
+    r = np.clip(np.asarray(r, dtype=np.float64), -1, 1)
+    df = np.asarray(n, dtype=np.float64) - 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = r * np.sqrt(df / ((1 - r) * (1 + r)))
+
+    return 2 * tdist.sf(np.abs(t), df)
+
+
+' a function for getting the sliding time-windows of data '
+
+def get_windows(data, time_win=5, time_step=5):
+
+    """
+    get the sliding time-windows of data as a strided view (no copy)
+
+    Parameters
+    ----------
+    data : array
+        The data. The shape must be [..., n_ts].
+    time_win : int. Default is 5.
+        The number of time-points in each time-window.
+    time_step : int. Default is 5.
+        The time step size between two time-windows.
+
+    Returns
+    -------
+    windows : array
+        The read-only view of the time-windows.
+        The shape of windows is [..., int((n_ts-time_win)/time_step)+1, time_win].
+    """
+
+    data = np.asarray(data)
+
+    if time_win < 1 or time_win > data.shape[-1] or time_step < 1:
+        raise ValueError("time_win must be from 1 to n_ts (%d) and time_step must be at least 1" % data.shape[-1])
+
+    # all windows with a step of 1, then every time_step-th of them
+    windows = np.lib.stride_tricks.sliding_window_view(data, time_win, axis=-1)
+
+    return windows[..., ::time_step, :]
+
+
+' a function for getting the searchlight units of data '
+
+def get_patches(data, ksize=[3, 3, 3], strides=[1, 1, 1]):
+
+    """
+    get the searchlight units of data as a strided view (no copy)
+
+    Parameters
+    ----------
+    data : array
+        The data. The shape must be [..., nx, ny, nz].
+    ksize : array or list [kx, ky, kz]. Default is [3, 3, 3].
+        The size of the calculation units for searchlight.
+    strides : array or list [sx, sy, sz]. Default is [1, 1, 1].
+        The strides for calculating along the x, y, z axis.
+
+    Returns
+    -------
+    patches : array
+        The read-only view of the calculation units.
+        The shape of patches is [..., n_x, n_y, n_z, kx, ky, kz]. n_x, n_y, n_z represent the number of calculation
+        units for searchlight along the x, y, z axis.
+    """
+
+    data = np.asarray(data)
+    nx, ny, nz = data.shape[-3:]
+
+    # the size of the calculation units & the strides
+    kx, ky, kz = ksize
+    sx, sy, sz = strides
+
+    # calculate the number of the calculation units in the x, y, z directions
+    n_x = int((nx - kx) / sx) + 1
+    n_y = int((ny - ky) / sy) + 1
+    n_z = int((nz - kz) / sz) + 1
+
+    bx, by, bz = data.strides[-3:]
+    shape = data.shape[:-3] + (n_x, n_y, n_z, kx, ky, kz)
+    strides = data.strides[:-3] + (bx*sx, by*sy, bz*sz, bx, by, bz)
+
+    return np.lib.stride_tricks.as_strided(data, shape=shape, strides=strides, writeable=False)
+
+
+' a function for calculating the sums in the searchlight units by summed-area tables '
+
+def box_sums(data, ksize=[3, 3, 3], strides=[1, 1, 1]):
+
+    """
+    calculate the sums of the values in each searchlight unit by 3-D summed-area (cumulative-sum) tables
+
+    Parameters
+    ----------
+    data : array
+        The data. The shape must be [..., nx, ny, nz].
+    ksize : array or list [kx, ky, kz]. Default is [3, 3, 3].
+        The size of the calculation units for searchlight.
+    strides : array or list [sx, sy, sz]. Default is [1, 1, 1].
+        The strides for calculating along the x, y, z axis.
+
+    Returns
+    -------
+    sums : array
+        The sums in each calculation unit.
+        The shape of sums is [..., n_x, n_y, n_z]. n_x, n_y, n_z represent the number of calculation units for
+        searchlight along the x, y, z axis.
+
+    Notes
+    -----
+    The cost is O(nx*ny*nz) whatever the size of the calculation units.
+    """
+
+    data = np.asarray(data, dtype=np.float64)
+    nx, ny, nz = data.shape[-3:]
+
+    # the size of the calculation units & the strides
+    kx, ky, kz = ksize
+    sx, sy, sz = strides
+
+    # calculate the number of the calculation units in the x, y, z directions
+    n_x = int((nx - kx) / sx) + 1
+    n_y = int((ny - ky) / sy) + 1
+    n_z = int((nz - kz) / sz) + 1
+
+    # the summed-area table with a leading zero along each axis
+    pad = [(0, 0)] * (data.ndim - 3) + [(1, 0), (1, 0), (1, 0)]
+    table = np.pad(data, pad, mode="constant")
+    table = np.cumsum(np.cumsum(np.cumsum(table, axis=-3), axis=-2), axis=-1)
+
+    # the lower & upper corners of each calculation unit
+    x0 = np.arange(n_x) * sx
+    y0 = np.arange(n_y) * sy
+    z0 = np.arange(n_z) * sz
+    x1, y1, z1 = x0 + kx, y0 + ky, z0 + kz
+
+    def corner(x, y, z):
+        return table[..., x[:, None, None], y[None, :, None], z[None, None, :]]
+
+    # inclusion-exclusion over the 8 corners
+    sums = corner(x1, y1, z1) - corner(x0, y1, z1) - corner(x1, y0, z1) - corner(x1, y1, z0) \
+        + corner(x0, y0, z1) + corner(x0, y1, z0) + corner(x1, y0, z0) - corner(x0, y0, z0)
+
+    return sums
+
+
+' a function for generating a block of a sparse random projection matrix '
+
+def sparse_projection(n_features, n_components, seed=0, block=0, density=1/3):
+
+    """
+    generate the rows of a sparse random projection matrix for a block of features
+
+    Parameters
+    ----------
+    n_features : int
+        The number of features in the block.
+    n_components : int
+        The number of dimensions after the projection.
+    seed : int. Default is 0.
+        The seed of the projection.
+    block : int. Default is 0.
+        The index of the block. Each (seed, block) gives the same rows, so the features can be projected chunk by chunk.
+    density : float. Default is 1/3.
+        The probability of an entry being nonzero. density=1/3 gives the projection of Achlioptas (2003), and
+        density=1/sqrt(n_total_features) gives the very sparse projection of Li, Hastie & Church (2006).
+
+    Returns
+    -------
+    R : scipy.sparse.csr_matrix [n_features, n_components]
+        The rows of the projection matrix. The entries are sqrt(1/(density*n_components)) times +1 or -1 with
+        probabilities density/2 and 0 with probability 1-density.
+    """
+
+    rs = np.random.RandomState([seed, block])
+    n = n_features*n_components
+
+    # only draw the positions of the nonzero entries: the gaps between them are geometric, so each entry is nonzero
+    # independently with probability density
+    size = int(n*density + 10*math.sqrt(n*density)) + 16
+    positions = np.cumsum(rs.geometric(density, size=size)) - 1
+    while positions[-1] < n:
+        positions = np.concatenate([positions, positions[-1] + np.cumsum(rs.geometric(density, size=size))])
+    positions = positions[positions < n]
+
+    # the random signs of the nonzero entries
+    values = (rs.randint(0, 2, size=len(positions))*2 - 1) * math.sqrt(1 / (density*n_components))
+
+    return csr_matrix((values, (positions // n_components, positions % n_components)),
+                      shape=(n_features, n_components))
+
+
+' a function for calculating the Johnson-Lindenstrauss distortion bound of a random projection '
+
+def jl_distortion(n_points, n_components):
+
+    """
+    calculate the bound on the distortion of the squared distances by a random projection
+
+    Parameters
+    ----------
+    n_points : int
+        The number of projected points, such as the number of conditions.
+    n_components : int
+        The number of dimensions after the projection.
+
+    Returns
+    -------
+    eps : float
+        With probability at least 1 - 1/n_points, all squared distances between the points are preserved within a
+        factor of (1 - eps, 1 + eps), by n_components >= 12*ln(n_points)/(eps^2/2 - eps^3/3). If n_components is too
+        small for any eps < 1, return inf.
+    """
+
+    # eps^2/2 - eps^3/3 is increasing on (0, 1), solve it by bisection
+    target = 12 * math.log(max(n_points, 2)) / n_components
+
+    if target >= 1/6:
+        return float("inf")
+
+    lo, hi = 0.0, 1.0
+    for i in range(60):
+        mid = (lo + hi) / 2
+        if mid*mid/2 - mid*mid*mid/3 < target:
+            lo = mid
+        else:
+            hi = mid
+
+    return hi
+
+
 ' a function for getting the affine of the fMRI-img '
 
 def get_affine(file_name):